@@ -0,0 +1,107 @@
+"""
+Local SQLite block store shared by the block fetching scripts.
+"""
+import json
+import sqlite3
+
+
+class BlockStore:
+    """
+    Local SQLite store of fetched blocks keyed by shard and block number.
+
+    Each block is stored with the detail level it was fetched with, and the ranges of blocks that
+    were completely fetched are checkpointed so that a re-run only has to fetch the gaps.
+    Used by `devops/get_blockchain/get_blockchain.py` and `devops/unsual-block-time/unusual-block-delay.py`,
+    so both scripts can be pointed at the same file. Use one file per network.
+    """
+    # Detail levels, a stored block can serve any request of a lower or equal level
+    HEADER = 0  # no transactions (hmyv2_getBlocks without txs)
+    TX_HASHES = 1  # transaction hashes only (hmy_getBlockByNumber with fullTx=false)
+    FULL_TX = 2  # full transactions (hmy_getBlockByNumber with fullTx=true)
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS blocks (
+                shard INTEGER NOT NULL,
+                number INTEGER NOT NULL,
+                level INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (shard, number)
+            );
+            CREATE TABLE IF NOT EXISTS completed_ranges (
+                shard INTEGER NOT NULL,
+                level INTEGER NOT NULL,
+                first_block INTEGER NOT NULL,
+                last_block INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS completed_ranges_idx ON completed_ranges (shard, level, first_block);
+        """)
+
+    def put(self, shard, level, blocks):
+        """
+        Store (number, block) pairs and checkpoint the ranges they cover, in a single transaction.
+        A stored block is never replaced by a less detailed one.
+        """
+        if not blocks:
+            return
+        with self.db:
+            self.db.executemany("""
+                INSERT INTO blocks (shard, number, level, data) VALUES (?, ?, ?, ?)
+                ON CONFLICT (shard, number) DO UPDATE SET level = excluded.level, data = excluded.data
+                WHERE excluded.level >= blocks.level
+            """, [(shard, number, level, json.dumps(block)) for number, block in blocks])
+            numbers = sorted(number for number, _ in blocks)
+            first = last = numbers[0]
+            for number in numbers[1:]:
+                if number > last + 1:
+                    self._complete(shard, level, first, last)
+                    first = number
+                last = number
+            self._complete(shard, level, first, last)
+
+    def _complete(self, shard, level, first, last):
+        # Merge with the overlapping or adjacent ranges of the same level
+        where = "shard = ? AND level = ? AND first_block <= ? AND last_block >= ?"
+        bounds = (shard, level, last + 1, first - 1)
+        for range_first, range_last in self.db.execute(f"SELECT first_block, last_block FROM completed_ranges "
+                                                       f"WHERE {where}", bounds).fetchall():
+            first, last = min(first, range_first), max(last, range_last)
+        self.db.execute(f"DELETE FROM completed_ranges WHERE {where}", bounds)
+        self.db.execute("INSERT INTO completed_ranges VALUES (?, ?, ?, ?)", (shard, level, first, last))
+
+    def gaps(self, shard, level, first, last):
+        """
+        Return the (first, last) inclusive ranges within [first, last] that have not been
+        completely fetched with at least the given detail level, in ascending order.
+        """
+        gaps = []
+        cursor = first
+        for range_first, range_last in self.db.execute("""
+                SELECT first_block, last_block FROM completed_ranges
+                WHERE shard = ? AND level >= ? AND last_block >= ? AND first_block <= ?
+                ORDER BY first_block
+        """, (shard, level, first, last)):
+            if range_first > cursor:
+                gaps.append((cursor, range_first - 1))
+            cursor = max(cursor, range_last + 1)
+        if cursor <= last:
+            gaps.append((cursor, last))
+        return gaps
+
+    def get(self, shard, number, level):
+        """
+        Return the stored block with at least the given detail level, None if there is none.
+        """
+        row = self.db.execute("SELECT data FROM blocks WHERE shard = ? AND number = ? AND level >= ?",
+                              (shard, number, level)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def blocks(self, shard, first, last, reverse=False):
+        """
+        Lazily yield the stored blocks within [first, last] inclusive, ordered by number.
+        """
+        order = "DESC" if reverse else "ASC"
+        for (data,) in self.db.execute(f"SELECT data FROM blocks WHERE shard = ? AND number BETWEEN ? AND ? "
+                                       f"ORDER BY number {order}", (shard, first, last)):
+            yield json.loads(data)
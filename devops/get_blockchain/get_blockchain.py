@@ -2,21 +2,39 @@
 """
 Simple script to get all blocks of a blockchain.
 
-Note that this is currently done sequentially.
+Blocks are fetched sequentially by default, use `--workers N` to fetch them in parallel
+over a pool of keep-alive connections.
 
 The script will create (or replace) the following files:
     1) `blockchain.json`: An ordered (desc) JSON array of all the blocks
+       (or `blockchain.ndjson[.gz|.zst]`: one block per line, written as blocks arrive, with `--ndjson`)
     2) `blockchain-bad-load.json`: An ordered (desc) list of block numbers that could not be fetched.
 
 Ex:
     $ python3 get_blockchain.py http://localhost:9500/ --min-height 1000  --max-height 10000 --print | jq
     $ python3 get_blockchain.py http://localhost:9500/ --min-height 1000  --max-height 10000 --stats
     $ python3 get_blockchain.py http://localhost:9500/ --min-height 1000  --max-height 10000 --no-txs --stats
+    $ python3 get_blockchain.py http://localhost:9500/ --min-height 1000  --max-height 10000 --workers 16 --stats
+    $ python3 get_blockchain.py http://localhost:9500/ --min-height 1000  --max-height 10000 --no-txs --batch-size 100
+    $ python3 get_blockchain.py http://localhost:9500/ --min-height 1000  --max-height 10000 --ndjson --compress gzip --stats
+    $ python3 get_blockchain.py http://localhost:9500/ --min-height 1000  --max-height 10000 --block-store blocks.db
+    $ python3 get_blockchain.py http://localhost:9500/ --min-height 1000  --max-height 10000 --by-hash --stats
+    $ python3 get_blockchain.py http://localhost:9500/ --min-height 1000  --max-height 10000 --columnar-stats
 """
 import requests
+import datetime
+import gzip
 import json
 import argparse
+import sqlite3
 import sys
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+from block_store import BlockStore
 
 num_blockchain = []
 num_bad_get_blocks = []
@@ -24,6 +42,16 @@ num_bad_get_blocks = []
 hash_blockchain = []
 hash_bad_get_blocks = []
 
+# Compression of the NDJSON output, mapped to the file extension
+ndjson_compressions = {
+    None: '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+# Shared by all requests (and worker threads) so that connections are kept alive and reused.
+session = requests.Session()
+
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Simple script to get all blocks of a blockchain')
@@ -32,15 +60,32 @@ def parse_args():
                                                                                         "default is None.")
     parser.add_argument("--min-height", dest="min_height", default=None, type=int, help="set the min block height, "
                                                                                         "default is None.")
-    parser.add_argument("--by-hash", dest="by_hash", action="store_true", help="get blockchain by hashes "
-                                                                               "instead of number (not implemented)")
+    parser.add_argument("--by-hash", dest="by_hash", action="store_true", help="get blockchain by following parent "
+                                                                               "hashes instead of by number, "
+                                                                               "sequentially")
+    parser.add_argument("--hash-index", dest="hash_index", default="blockchain-hash-index.db",
+                        help="SQLite file of the block hash to number index used by --by-hash, "
+                             "default is blockchain-hash-index.db.")
     parser.add_argument("--no-txs", dest="get_txs", action="store_false", help="do NOT get full tx data")
     parser.add_argument("--stats", dest="stats", action="store_true", help="get stats after processing blockchain")
+    parser.add_argument("--columnar-stats", dest="columnar_stats", action="store_true",
+                        help="get stats with per epoch and per hour breakdowns (written to blockchain-stats.json) "
+                             "after processing blockchain, requires numpy")
     parser.add_argument("--print", dest="print", action="store_true", help="print blockchain data once done")
+    parser.add_argument("--workers", dest="workers", default=1, type=int, help="number of parallel fetch workers, "
+                                                                               "default is 1.")
+    parser.add_argument("--batch-size", dest="batch_size", default=1, type=int, help="number of blocks requested per "
+                                                                                     "JSON-RPC batch, default is 1.")
+    parser.add_argument("--ndjson", dest="ndjson", action="store_true", help="stream blocks to a newline-delimited "
+                                                                             "JSON file as they are fetched")
+    parser.add_argument("--compress", dest="compress", default=None, choices=["gzip", "zstd"],
+                        help="compress the NDJSON output (zstd requires the `zstandard` module)")
+    parser.add_argument("--block-store", dest="block_store", default=None, help="SQLite file to keep fetched blocks "
+                                                                                "in, re-runs only fetch missing blocks")
     return parser.parse_args()
 
 
-def get_block_number(block_num, endpoint, get_tx_info=False):
+def get_block_number(block_num, endpoint, get_tx_info=False, bad_get_blocks=None):
     url = endpoint
     payload = json.dumps({
         "jsonrpc": "2.0",
@@ -54,23 +99,68 @@ def get_block_number(block_num, endpoint, get_tx_info=False):
     headers = {
         'Content-Type': 'application/json'
     }
-    response = requests.request('POST', url, headers=headers, data=payload, allow_redirects=False, timeout=30)
+    response = session.request('POST', url, headers=headers, data=payload, allow_redirects=False, timeout=30)
     try:
         returned = json.loads(response.content)["result"]
         return returned
     except Exception:  # Catch all to not halt
-        num_bad_get_blocks.append({
+        (num_bad_get_blocks if bad_get_blocks is None else bad_get_blocks).append({
             'block-num': block_num,
             'reason': f"Failed to json load block {block_num}. Content: {response.content}"
         })
         print(f"\n[!!!] Failed to json load block {block_num}. Content: {response.content}\n")
 
 
-def get_block_hash(block_hash, endpoint, get_tx_info=False):
+def get_block_numbers(block_nums, endpoint, get_tx_info=False):
+    """
+    Get several blocks with a single JSON-RPC batch request.
+
+    Responses are matched to their request by `id` (the block number). Items that failed are
+    recorded in `num_bad_get_blocks` and returned as None, the rest of the batch is kept.
+    """
     url = endpoint
-    payload = json.dumps({
+    payload = json.dumps([{
         "jsonrpc": "2.0",
         "method": "hmy_getBlockByNumber",
+        "params": [
+            str(hex(block_num)),
+            get_tx_info
+        ],
+        "id": block_num
+    } for block_num in block_nums])
+    headers = {
+        'Content-Type': 'application/json'
+    }
+    response = session.request('POST', url, headers=headers, data=payload, allow_redirects=False, timeout=30)
+    try:
+        returned = {item["id"]: item for item in json.loads(response.content)}
+    except Exception:  # Catch all to not halt
+        for block_num in block_nums:
+            num_bad_get_blocks.append({
+                'block-num': block_num,
+                'reason': f"Failed to json load batch {block_nums[0]}-{block_nums[-1]}. Content: {response.content}"
+            })
+        print(f"\n[!!!] Failed to json load batch {block_nums[0]}-{block_nums[-1]}. Content: {response.content}\n")
+        return [None] * len(block_nums)
+    blocks = []
+    for block_num in block_nums:
+        try:
+            blocks.append(returned[block_num]["result"])
+        except Exception:  # Catch all to not halt
+            num_bad_get_blocks.append({
+                'block-num': block_num,
+                'reason': f"Failed to json load block {block_num}. Content: {json.dumps(returned.get(block_num))}"
+            })
+            print(f"\n[!!!] Failed to json load block {block_num}. Content: {json.dumps(returned.get(block_num))}\n")
+            blocks.append(None)
+    return blocks
+
+
+def get_block_hash(block_hash, endpoint, get_tx_info=False, bad_get_blocks=None):
+    url = endpoint
+    payload = json.dumps({
+        "jsonrpc": "2.0",
+        "method": "hmy_getBlockByHash",
         "params": [
             block_hash if block_hash.startswith('0x') else '0x' + block_hash,
             get_tx_info
@@ -80,12 +170,12 @@ def get_block_hash(block_hash, endpoint, get_tx_info=False):
     headers = {
         'Content-Type': 'application/json'
     }
-    response = requests.request('POST', url, headers=headers, data=payload, allow_redirects=False, timeout=30)
+    response = session.request('POST', url, headers=headers, data=payload, allow_redirects=False, timeout=30)
     try:
         returned = json.loads(response.content)["result"]
         return returned
     except Exception:  # Catch all to not halt
-        hash_bad_get_blocks.append({
+        (hash_bad_get_blocks if bad_get_blocks is None else bad_get_blocks).append({
             'block-hash': block_hash,
             'reason': f"Failed to json load block {block_hash}. Content: {response.content}"
         })
@@ -104,7 +194,7 @@ def get_latest_header(endpoint):
     headers = {
         'Content-Type': 'application/json'
     }
-    response = requests.request('POST', url, headers=headers, data=payload, allow_redirects=False, timeout=30)
+    response = session.request('POST', url, headers=headers, data=payload, allow_redirects=False, timeout=30)
     return json.loads(response.content)["result"]
 
 
@@ -113,15 +203,378 @@ def get_curr_block_height(endpoint):
     return int(header["blockNumber"])
 
 
+def get_shard_id(endpoint):
+    header = get_latest_header(endpoint)
+    return int(header["shardID"])
+
+
+def setup_session(workers):
+    """
+    Size the connection pool of the shared session so that each worker keeps its own connection alive.
+    """
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(workers, 1))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+
+def fetch_blocks(heights, endpoint, get_tx_info=False, workers=1, batch_size=1):
+    """
+    Yield the block (or None on failure) for each of the given heights, in the given order.
+
+    Heights are requested `batch_size` at a time (as a JSON-RPC batch when more than 1).
+    With more than 1 worker, batches are issued by a thread pool that is kept a bounded
+    number of batches ahead of the consumer, so the output order is preserved.
+    """
+    def fetch(batch):
+        if len(batch) == 1:
+            return [get_block_number(batch[0], endpoint, get_tx_info)]
+        return get_block_numbers(list(batch), endpoint, get_tx_info)
+
+    batches = (heights[k:k + batch_size] for k in range(0, len(heights), batch_size))
+    if workers <= 1:
+        for batch in batches:
+            yield from fetch(batch)
+        return
+    ahead = workers * 4
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for batch in batches:
+            pending.append(executor.submit(fetch, batch))
+            if len(pending) >= ahead:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def fetch_blocks_with_store(store, shard, min_height, max_height, endpoint, get_tx_info=False, workers=1,
+                            batch_size=1):
+    """
+    Like `fetch_blocks` for the heights max_height - 1 down to min_height, but ranges that were already
+    completed are read from the block store and only the gaps are fetched (and stored as they arrive).
+    """
+    level = BlockStore.FULL_TX if get_tx_info else BlockStore.TX_HASHES
+    cursor = max_height - 1
+    for first, last in reversed(store.gaps(shard, level, min_height, max_height - 1)):
+        if last < cursor:
+            yield from store.blocks(shard, last + 1, cursor, reverse=True)
+        heights = range(last, first - 1, -1)
+        fetched = []
+        try:
+            for i, block in zip(heights, fetch_blocks(heights, endpoint, get_tx_info, workers, batch_size)):
+                if block and type(block['stakingTransactions']) == list and type(block['transactions']) == list:
+                    fetched.append((i, block))
+                if len(fetched) >= 1000:
+                    store.put(shard, level, fetched)
+                    fetched = []
+                yield block
+        finally:  # Checkpoint what was fetched even if interrupted
+            store.put(shard, level, fetched)
+        cursor = first - 1
+    if cursor >= min_height:
+        yield from store.blocks(shard, min_height, cursor, reverse=True)
+
+
+class HashIndex:
+    """
+    On-disk (SQLite) index of block hash to block number, per shard.
+
+    Lookups in both directions are a single indexed query, so walked hashes don't need to be
+    resolved over RPC again and a changed hash at a known number (a reorg) is detected on the spot.
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS block_hashes (
+                shard INTEGER NOT NULL,
+                number INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (shard, number)
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS block_hashes_hash_idx ON block_hashes (shard, hash);
+        """)
+
+    def number_of(self, shard, block_hash):
+        row = self.db.execute("SELECT number FROM block_hashes WHERE shard = ? AND hash = ?",
+                              (shard, block_hash)).fetchone()
+        return row[0] if row else None
+
+    def hash_of(self, shard, number):
+        row = self.db.execute("SELECT hash FROM block_hashes WHERE shard = ? AND number = ?",
+                              (shard, number)).fetchone()
+        return row[0] if row else None
+
+    def add(self, shard, block_hash, number):
+        """
+        Index a block hash, returning the hash previously indexed at that number if it was different (reorg).
+        Changes are committed with `commit`.
+        """
+        previous_hash = self.hash_of(shard, number)
+        if previous_hash == block_hash:
+            return None
+        self.db.execute("DELETE FROM block_hashes WHERE shard = ? AND hash = ?", (shard, block_hash))
+        self.db.execute("INSERT OR REPLACE INTO block_hashes VALUES (?, ?, ?)", (shard, number, block_hash))
+        return previous_hash
+
+    def commit(self):
+        self.db.commit()
+
+
+def fetch_blocks_by_hash(heights, endpoint, get_tx_info, index, shard, store=None):
+    """
+    Yield the block (or None on failure) for each of the given descending heights by following
+    `parentHash` links from the first block, which is fetched by number.
+
+    Walked hashes are recorded in the hash index, and an indexed hash whose block is in the block
+    store (if any) is read locally instead of over RPC. If a link cannot be followed, the walk
+    resumes from the next height fetched by number.
+
+    Blocks that could not be loaded either way are recorded in `hash_bad_get_blocks`, with the
+    hash that was followed (None if there was none) and the reasons of the failed requests.
+    """
+    level = BlockStore.FULL_TX if get_tx_info else BlockStore.TX_HASHES
+    block_hash = None
+    fetched = []
+    try:
+        for i in heights:
+            block = None
+            failures = []  # Only reported if the fallback fails too
+            if block_hash is not None:
+                number = index.number_of(shard, block_hash)
+                if store and number is not None:
+                    block = store.get(shard, number, level)
+                    if block is not None and block['hash'] != block_hash:  # Stored from another fork
+                        block = None
+                if block is None:
+                    block = get_block_hash(block_hash, endpoint, get_tx_info, failures)
+            if block is None:
+                block = get_block_number(i, endpoint, get_tx_info, failures)
+            if block is None:
+                hash_bad_get_blocks.append({
+                    'block-num': i,
+                    'block-hash': block_hash,
+                    'reason': ' / '.join(failure['reason'] for failure in failures) or f"Block {i} had a null response"
+                })
+            block_hash = None
+            if block:
+                previous_hash = index.add(shard, block['hash'], i)
+                if previous_hash is not None:
+                    print(f"\n[!] WARNING block {i} hash changed from {previous_hash} to {block['hash']} (reorg)\n")
+                block_hash = block['parentHash']
+                if store and type(block['stakingTransactions']) == list and type(block['transactions']) == list:
+                    fetched.append((i, block))
+            if len(fetched) >= 1000:
+                store.put(shard, level, fetched)
+                index.commit()
+                fetched = []
+            yield block
+    finally:  # Checkpoint what was walked even if interrupted
+        if store:
+            store.put(shard, level, fetched)
+        index.commit()
+
+
+def open_blocks_file(path, mode):
+    """
+    Open a (possibly gzip/zstd compressed, based on the extension) text file in mode 'w' or 'r'.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    if path.endswith('.zst'):
+        import zstandard  # Optional dependency, only needed for zstd output
+        return zstandard.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class NdjsonWriter:
+    """
+    Append blocks to a newline-delimited JSON file, flushing every `flush_blocks` blocks or `flush_seconds`
+    seconds so that a crash keeps most of what was fetched without a (compressor) flush per block.
+
+    Exposes `append` so it can be used in place of the in-memory block list.
+    """
+
+    def __init__(self, path, flush_blocks=1000, flush_seconds=5):
+        self.path = path
+        self.file = open_blocks_file(path, 'w')
+        self.flush_blocks = flush_blocks
+        self.flush_seconds = flush_seconds
+        self.pending = 0
+        self.flushed_at = time.monotonic()
+
+    def append(self, block):
+        self.file.write(json.dumps(block) + '\n')
+        self.pending += 1
+        if self.pending >= self.flush_blocks or time.monotonic() - self.flushed_at >= self.flush_seconds:
+            self.file.flush()
+            self.pending = 0
+            self.flushed_at = time.monotonic()
+
+    def close(self):
+        self.file.close()
+
+
+def read_blocks(path):
+    """
+    Lazily yield the blocks of a NDJSON file written by `NdjsonWriter`.
+
+    A truncated last line or compressed stream (the writer was interrupted) is reported and skipped.
+    """
+    truncated = (EOFError,)  # gzip stream without its end marker
+    if path.endswith('.zst'):
+        import zstandard
+        truncated += (zstandard.ZstdError,)
+    with open_blocks_file(path, 'r') as f:
+        try:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"\n[!] WARNING skipping truncated line in {path}\n")
+        except truncated:
+            print(f"\n[!] WARNING skipping truncated end of {path}\n")
+
+
+def print_blocks(blocks):
+    """
+    Print blocks as a single JSON array without holding them all in memory.
+    """
+    sys.stdout.write('[')
+    for k, block in enumerate(blocks):
+        sys.stdout.write((', ' if k else '') + json.dumps(block))
+    sys.stdout.write(']\n')
+    sys.stdout.flush()
+
+
+def format_atto(atto_amount):
+    """
+    Exact decimal string in ONE of an integer atto amount.
+    """
+    one, atto = divmod(atto_amount, 10 ** 18)
+    return f"{one}.{atto:018d}".rstrip('0').rstrip('.')
+
+
+def load_columns(data):
+    """
+    Load blocks into NumPy columns in a single pass over `data` (any iterable, consumed once).
+
+    Returns a dict of arrays:
+        - per block: `number`, `timestamp`, `epoch`, `plain_tx` and `staking_tx` counts
+        - per plain tx with a value: `value_block` (block row) and `value_limbs`, the exact atto value
+          split in 3 base 2**32 limbs (shape (3, n)) so that sums stay exact in uint64
+        - per staking tx with a type: `staking_block` (block row), `staking_type` (code) and `staking_types` (names)
+    Empty (failed) blocks are skipped, their number is returned as `empty_blocks`.
+    """
+    import numpy as np
+    columns = {name: array('q') for name in ('number', 'timestamp', 'epoch', 'plain_tx', 'staking_tx',
+                                             'value_block', 'staking_block', 'staking_type')}
+    limbs = (array('Q'), array('Q'), array('Q'))
+    type_codes = {}
+    empty_blocks = 0
+    for blk in data:
+        if not blk:
+            empty_blocks += 1
+            continue
+        row = len(columns['number'])
+        columns['number'].append(int(blk['number'], 16))
+        columns['timestamp'].append(int(blk['timestamp'], 16))
+        columns['epoch'].append(int(blk['epoch'], 16))
+        columns['plain_tx'].append(len(blk['transactions']))
+        columns['staking_tx'].append(len(blk['stakingTransactions']))
+        for tx in blk['transactions']:
+            if 'value' in tx:
+                atto_amt = int(tx['value'], 16)
+                columns['value_block'].append(row)
+                limbs[0].append(atto_amt & 0xFFFFFFFF)
+                limbs[1].append((atto_amt >> 32) & 0xFFFFFFFF)
+                limbs[2].append(atto_amt >> 64)
+        for stx in blk['stakingTransactions']:
+            if 'type' in stx:
+                columns['staking_block'].append(row)
+                columns['staking_type'].append(type_codes.setdefault(stx['type'], len(type_codes)))
+    loaded = {name: np.frombuffer(column, dtype=np.int64) for name, column in columns.items()}
+    loaded['value_limbs'] = np.stack([np.frombuffer(limb, dtype=np.uint64) for limb in limbs])
+    loaded['staking_types'] = np.array(list(type_codes), dtype=object)
+    loaded['empty_blocks'] = empty_blocks
+    return loaded
+
+
+def columnar_stats(data, output_file='blockchain-stats.json'):
+    """
+    Vectorized version of `stats`, adding per epoch and per hour (UTC) breakdowns written to `output_file`.
+    Amounts are summed exactly as integer atto.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        print("[!] --columnar-stats requires numpy: python3 -m pip install numpy")
+        return
+
+    def atto_sums(limb_sums):
+        # Recombine (3, n) uint64 limb sums into exact python integers
+        return [int(lo) + (int(mid) << 32) + (int(hi) << 64) for lo, mid, hi in limb_sums.T]
+
+    def group_by(keys):
+        # Unique keys with the block count, plain/staking tx counts and exact plain tx amount of each group
+        groups, block_group = np.unique(keys, return_inverse=True)
+        limb_sums = np.zeros((3, len(groups)), dtype=np.uint64)
+        np.add.at(limb_sums, (slice(None), block_group[cols['value_block']]), cols['value_limbs'])
+        return [{
+            'blocks': int(blocks),
+            'plain-tx': int(plain),
+            'staking-tx': int(staking),
+            'plain-tx-amount': format_atto(amount),
+        } for blocks, plain, staking, amount in zip(
+            np.bincount(block_group, minlength=len(groups)),
+            np.bincount(block_group, weights=cols['plain_tx'], minlength=len(groups)),
+            np.bincount(block_group, weights=cols['staking_tx'], minlength=len(groups)),
+            atto_sums(limb_sums))], groups
+
+    print("\n=== Stats for fetched blocks ===\n")
+    cols = load_columns(data)
+    plain_tx_count = int(cols['plain_tx'].sum())
+    staking_tx_count = int(cols['staking_tx'].sum())
+    plain_tx_amt_count = atto_sums(cols['value_limbs'].sum(axis=1, dtype=np.uint64).reshape(3, 1))[0]
+    type_count = dict(zip(cols['staking_types'].tolist(),
+                          np.bincount(cols['staking_type'], minlength=len(cols['staking_types'])).tolist()))
+    # Like `stats`, failed blocks count as fetched
+    print(f"Total Blocks Fetched: {len(cols['number']) + cols['empty_blocks']}")
+    print(f"Total tx count: {plain_tx_count + staking_tx_count}")
+    print(f"Plain tx count: {plain_tx_count}")
+    print(f"Total amount sent via plain tx: {format_atto(plain_tx_amt_count)}")
+    print(f"Staking tx count: {staking_tx_count}")
+    print(f"Staking tx type count breakdown: {json.dumps(type_count, indent=4)}")
+
+    per_epoch, epochs = group_by(cols['epoch'])
+    per_hour, hours = group_by(cols['timestamp'] // 3600)
+    staking_per_epoch = {}
+    staking_keys, staking_counts = np.unique(np.stack([cols['epoch'][cols['staking_block']], cols['staking_type']]),
+                                             axis=1, return_counts=True)
+    for (epoch, type_code), count in zip(staking_keys.T.tolist(), staking_counts.tolist()):
+        staking_per_epoch.setdefault(epoch, {})[cols['staking_types'][type_code]] = count
+    for epoch, entry in zip(epochs.tolist(), per_epoch):
+        entry['epoch'] = epoch
+        entry['staking-tx-types'] = staking_per_epoch.get(epoch, {})
+    for hour, entry in zip(hours.tolist(), per_hour):
+        entry['hour'] = datetime.datetime.fromtimestamp(hour * 3600, tz=datetime.timezone.utc).isoformat()
+    with open(output_file, 'w') as f:
+        json.dump({'per-epoch': per_epoch, 'per-hour': per_hour}, f, indent=4)
+    print(f"Per epoch and per hour breakdowns: {output_file} ({len(per_epoch)} epochs, {len(per_hour)} hours)")
+
+
 def stats(data):
+    """
+    Print stats of the given blocks, `data` can be any iterable (e.g. `read_blocks`) and is consumed once.
+    """
     print("\n=== Stats for fetched blocks ===\n")
     type_count = {}
+    block_count = 0
     total_tx_count = 0
     staking_tx_count = 0
     plain_tx_count = 0
     plain_tx_amt_count = 0
-    print(f"Total Blocks Fetched: {len(data)}")
     for blk in data:
+        block_count += 1
         if 'stakingTransactions' in blk.keys():
             total_tx_count += len(blk['stakingTransactions'])
             for stx in blk['stakingTransactions']:
@@ -135,11 +588,11 @@ def stats(data):
             for tx in blk['transactions']:
                 plain_tx_count += 1
                 if 'value' in tx:
-                    atto_amt = int(tx['value'], 16)
-                    plain_tx_amt_count += atto_amt * 1e-18
+                    plain_tx_amt_count += int(tx['value'], 16)
+    print(f"Total Blocks Fetched: {block_count}")
     print(f"Total tx count: {total_tx_count}")
     print(f"Plain tx count: {plain_tx_count}")
-    print(f"Total amount sent via plain tx: {plain_tx_amt_count}")
+    print(f"Total amount sent via plain tx: {format_atto(plain_tx_amt_count)}")
     print(f"Staking tx count: {staking_tx_count}")
     print(f"Staking tx type count breakdown: {json.dumps(type_count, indent=4)}")
 
@@ -149,58 +602,69 @@ if __name__ == "__main__":
     max_height = get_curr_block_height(args.endpoint) if args.max_height is None else args.max_height
     min_height = 0 if args.min_height is None else args.min_height
     assert max_height > min_height
+    assert args.workers > 0
+    assert args.batch_size > 0
+    # The hash walk is sequential, each block's parent hash is only known once the block is fetched
+    assert not args.by_hash or (args.workers == 1 and args.batch_size == 1), "--by-hash is sequential, " \
+                                                                             "--workers and --batch-size must be 1"
+    setup_session(args.workers)
     total_blocks_count = max_height - min_height
-    for k, i in enumerate(reversed(range(min_height, max_height))):
+    heights = range(max_height - 1, min_height - 1, -1)
+    bad_get_blocks = hash_bad_get_blocks if args.by_hash else num_bad_get_blocks
+    if args.ndjson:
+        blockchain = NdjsonWriter(f'blockchain.ndjson{ndjson_compressions[args.compress]}')
+    else:
+        blockchain = hash_blockchain if args.by_hash else num_blockchain
+    store = BlockStore(args.block_store) if args.block_store else None
+    if args.by_hash:
+        blocks = fetch_blocks_by_hash(heights, args.endpoint, args.get_txs, HashIndex(args.hash_index),
+                                      get_shard_id(args.endpoint), store)
+    elif store:
+        blocks = fetch_blocks_with_store(store, get_shard_id(args.endpoint), min_height, max_height, args.endpoint,
+                                         args.get_txs, args.workers, args.batch_size)
+    else:
+        blocks = fetch_blocks(heights, args.endpoint, args.get_txs, args.workers, args.batch_size)
+    for k, (i, block) in enumerate(zip(heights, blocks)):
         if not args.print:
             sys.stdout.write(f"\rFetched {k}/{total_blocks_count} blocks")
             sys.stdout.flush()
-        if not args.by_hash:
-            block = get_block_number(i, args.endpoint, args.get_txs)
-            if block is None:
-                num_bad_get_blocks.append({
-                    'block-num': i,
-                    'reason': f"Block {i} had a null response: {block}"
-                })
-                print(f"\n[!] WARNING block {i} had a null response: {block}\n")
-            elif block['stakingTransactions'] is None or type(block['stakingTransactions']) != list:
-                num_bad_get_blocks.append({
-                    'block-num': i,
-                    'reason': f"Block {i} had a null response for staking transactions: {block['stakingTransactions']}"
-                })
-                print(f"\n[!] WARNING Block {i} had a null response for staking transactions: "
-                      f"{block['stakingTransactions']}\n")
-            elif block['transactions'] is None or type(block['transactions']) != list:
-                num_bad_get_blocks.append({
-                    'block-num': i,
-                    'reason': f"Block {i} had a null response for plain transactions: {block['transactions']}"
-                })
-                print(f"\n[!] WARNING block {i} had a null response for plain transactions: "
-                      f"{block['transactions']}\n")
-            num_blockchain.append(block if block else {})
-        else:
-            raise Exception("Not implemented")
+        reason = None
+        if block is None:
+            reason = f"Block {i} had a null response: {block}"
+            print(f"\n[!] WARNING block {i} had a null response: {block}\n")
+        elif block['stakingTransactions'] is None or type(block['stakingTransactions']) != list:
+            reason = f"Block {i} had a null response for staking transactions: {block['stakingTransactions']}"
+            print(f"\n[!] WARNING Block {i} had a null response for staking transactions: "
+                  f"{block['stakingTransactions']}\n")
+        elif block['transactions'] is None or type(block['transactions']) != list:
+            reason = f"Block {i} had a null response for plain transactions: {block['transactions']}"
+            print(f"\n[!] WARNING block {i} had a null response for plain transactions: "
+                  f"{block['transactions']}\n")
+        if reason is not None and not args.by_hash:
+            bad_get_blocks.append({'block-num': i, 'reason': reason})
+        elif reason is not None and block is not None:  # The hash walker records the blocks it could not load
+            bad_get_blocks.append({'block-num': i, 'block-hash': block['hash'], 'reason': reason})
+        blockchain.append(block if block else {})
     if not args.print:
         sys.stdout.write(f"\r")
         sys.stdout.flush()
+        print(f"\nTotal bad loads with {'hash' if args.by_hash else 'number'}: {len(bad_get_blocks)}")
     if not args.by_hash:
-        if not args.print:
-            print(f"\nTotal bad loads with number: {len(num_bad_get_blocks)}")
-        with open(f'blockchain.json', 'w') as f:
-            json.dump(num_blockchain, f, indent=4)
-        with open(f'blockchain-bad-load.json', 'w') as f:
-            json.dump(num_bad_get_blocks, f, indent=4)
-        if args.stats:
-            stats(num_blockchain)
-        if args.print:
-            print(json.dumps(num_blockchain))
+        # Workers and batches may report failures out of order, keep the file ordered (desc) like the blockchain.
+        num_bad_get_blocks.sort(key=lambda bad: bad['block-num'], reverse=True)
+    if args.ndjson:
+        blockchain.close()
     else:
-        if not args.print:
-            print(f"\nTotal bad loads with hash: {len(hash_bad_get_blocks)}")
         with open(f'blockchain.json', 'w') as f:
-            json.dump(hash_blockchain, f, indent=4)
-        with open(f'blockchain-bad-load.json', 'w') as f:
-            json.dump(hash_bad_get_blocks, f, indent=4)
-        if args.stats:
-            stats(num_blockchain)
-        if args.print:
-            print(json.dumps(hash_blockchain))
+            json.dump(blockchain, f, indent=4)
+    with open(f'blockchain-bad-load.json', 'w') as f:
+        json.dump(bad_get_blocks, f, indent=4)
+    if args.stats:
+        stats(read_blocks(blockchain.path) if args.ndjson else blockchain)
+    if args.columnar_stats:
+        columnar_stats(read_blocks(blockchain.path) if args.ndjson else blockchain)
+    if args.print:
+        if args.ndjson:
+            print_blocks(read_blocks(blockchain.path))
+        else:
+            print(json.dumps(blockchain))
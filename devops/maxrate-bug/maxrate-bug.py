@@ -2,14 +2,44 @@ from pyhmy import rpc
 from pyhmy import staking, blockchain
 import json
 import os
+import gzip
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from staking_tx_history import gather_staking_transactions
 
 # Harmony RPC endpoint
 harmony_rpc_url = "https://a.api.s0.t.hmny.io"
-# numbre of pages required to get through all validators in validator_all_information
-allvalidatorpages = 14
+# number of validator_all_information pages requested at once, until the first empty page
+validator_page_batch = 4
+# max concurrent validator_all_information page requests
+page_workers = 8
+# number of epochs fetched concurrently ahead of the analysis
+epoch_workers = 4
 # max_rate threshold
 max_rate_threshold = 0.93
+# directory of the validator snapshot cache
+snapshot_dir = "validator-infos"
+
+parser = argparse.ArgumentParser()
+# 1673 is the HIP30 with start of mimimum 7%
+# 1733 is the maxrate epoch where we wanted wanted to fix the max_rate for validator below 7%
+# which introduce the issue of validator with 107%
+parser.add_argument('--start-epoch', dest='start_epoch', type=int, default=1733, help="First epoch of the audit")
+parser.add_argument('--last-epoch', dest='last_epoch', type=int, default=1973, help="Last epoch of the audit")
+parser.add_argument('--recent-epoch', dest='recent_epoch', type=int, default=1975, help="Epoch the pending undelegations are checked against")
+parser.add_argument('--latest', action='store_true', help="Audit up to two epochs before the current one, checked against the last finished one, for daily runs")
+parser.add_argument('--checkpoint', dest='checkpoint', default="ledger-checkpoint.json", help="Ledger state saved after every epoch, resumed from if present")
+args = parser.parse_args()
+
+# epochs are read at their last block, so the current epoch can't be read yet: the last finished epoch is the
+# recent epoch, and the audit stops one epoch before it so the recent state is later than any audited epoch
+# (note the default range stays two epochs behind instead, auditing up to 1973 against 1975)
+if args.latest:
+    current_epoch = blockchain.get_current_epoch(endpoint=harmony_rpc_url)
+    args.recent_epoch = current_epoch - 1
+    args.last_epoch = current_epoch - 2
 
 # from epoch 7% activation, check for all >93$ max rate validator and for all epoch
 # the pending undelegation ojects and confirm if over time to now, they were cleared
@@ -20,25 +50,100 @@ def write_json_to_file(json_object, filename):
 
     print(f"{filename} has been created")
 
+# shared by every epoch fetch, bounding the concurrent page requests to page_workers
+page_executor = ThreadPoolExecutor(max_workers=page_workers)
+
+# fetch the validator_all_information pages of a block, in order, until the first empty page
+def get_all_validator_pages_at_block(blocknum):
+    pages = []
+    while True:
+        futures = [page_executor.submit(staking.get_all_validator_information_by_block_number,
+                block_num=blocknum, page=i, endpoint=harmony_rpc_url)
+            for i in range(len(pages), len(pages) + validator_page_batch)]
+        for future in futures:
+            page = future.result()
+            if len(page) == 0:
+                return pages
+            pages.append(page)
+
+# validator snapshot cache
+# each block's high fee validators are stored in a gzip JSON file, keeping only the fields the audit uses,
+# and the manifest maps each cached block to its file so nothing is read or listed for a cache miss
+manifest_path = f"{snapshot_dir}/manifest.json"
+manifest_lock = threading.Lock()
+
+def load_manifest():
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as file:
+        return json.load(file)
+
+# block number (as string) -> {'file': snapshot file name, 'validators': number of validators}
+manifest = load_manifest()
+
+# a validator is stored as [address, max-rate, [[delegator address, [[epoch, amount], ...]], ...]]
+def compact_validator(validator):
+    return [validator['validator']['address'], validator['validator']['max-rate'],
+        [[delegation['delegator-address'], [[undelegation['epoch'], undelegation['amount']] for undelegation in delegation['undelegations']]]
+            for delegation in validator['validator']['delegations']]]
+
+# back to the validator_all_information layout, with only the fields the audit uses
+def expand_validator(compact):
+    address, max_rate, delegations = compact
+    return {'validator': {'address': address, 'max-rate': max_rate, 'delegations': [
+        {'delegator-address': delegator, 'undelegations': [{'epoch': epoch, 'amount': amount} for epoch, amount in undelegations]}
+            for delegator, undelegations in delegations]}}
+
+def write_snapshot(blocknum, validators):
+    os.makedirs(snapshot_dir, exist_ok=True)
+    filename = f"Validator_infos_{blocknum}.json.gz"
+    with gzip.open(f"{snapshot_dir}/{filename}.tmp", 'wt') as file:
+        json.dump([compact_validator(validator) for validator in validators], file, separators=(',', ':'))
+    os.replace(f"{snapshot_dir}/{filename}.tmp", f"{snapshot_dir}/{filename}")
+
+    with manifest_lock:
+        manifest[str(blocknum)] = {'file': filename, 'validators': len(validators)}
+        with open(f"{manifest_path}.tmp", 'w') as file:
+            json.dump(manifest, file, indent=4)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+
+# returns the cached validators of a block, None if the block is not cached
+def load_snapshot(blocknum):
+    entry = manifest.get(str(blocknum))
+    if entry is None:
+        return None
+    try:
+        with gzip.open(f"{snapshot_dir}/{entry['file']}", 'rt') as file:
+            return [expand_validator(compact) for compact in json.load(file)]
+    except FileNotFoundError:
+        # the snapshot file was removed, fetch the block again (its manifest entry is replaced then)
+        return None
+
 def get_all_high_fee_validators_at_block(blocknum):
-    validators = []
-    # file where the previous validator_all_information was processed
-    filepath = f"validator-infos/Validator_all_infos_{blocknum}.json"
+    # load the cached snapshot if any
+    validators = load_snapshot(blocknum)
+    if validators is not None:
+        print(f"Loaded and returned data from {snapshot_dir}/{manifest[str(blocknum)]['file']}")
+        return validators
+
+    # file where the previous validator_all_information was processed by older versions
+    filepath = f"{snapshot_dir}/Validator_all_infos_{blocknum}.json"
 
-    # load previous file if any is existing
+    # convert previous file if any is existing
     if os.path.exists(filepath):
         with open(filepath, 'r') as file:
             validators = json.load(file)
             print(f"Loaded and returned data from {filepath}")
-            return validators
+        write_snapshot(blocknum, validators)
+        os.remove(filepath)
+        return validators
+
+    validators = []
 
     seen_addresses = set()
 
     # Iterate through pages to get the list of all validators
-    for i in range(allvalidatorpages):
-        # Fetch the validators for the current page
-        current_validators = staking.get_all_validator_information_by_block_number(block_num=blocknum, page=i, endpoint=harmony_rpc_url)
-
+    for current_validators in get_all_validator_pages_at_block(blocknum):
         for validator in current_validators:
             # Extract the validator address
             validator_address = validator['validator']['address']
@@ -56,7 +161,7 @@ def get_all_high_fee_validators_at_block(blocknum):
 
     print(f"get all high fee validators detail at block {blocknum} done")
 
-    write_json_to_file(validators, f"validator-infos/Validator_all_infos_{blocknum}.json")
+    write_snapshot(blocknum, validators)
 
     return validators
 
@@ -80,21 +185,27 @@ def atto_to_one(atto_amount):
 # - malicious : whether the delegator account has been flagged malicious or not
 all_pending_undelegation=[]
 
+# the same undelegation objects, keyed by (validator, delegator, epoch)
+undelegation_ledger = {}
+
+# undelegations not cleared yet, per validator address, keyed by (validator, delegator, epoch)
+# kept in insertion order, like all_pending_undelegation
+open_undelegations = {}
+
 # take an undelegation object and will update all_pending_undelegation
 def add_undelegation(validator, delegator, undelegation):
+    key = (validator, delegator, undelegation['epoch'])
+
     # Check if the undelegation already exists
-    for existing_undelegation in all_pending_undelegation:
-        if (existing_undelegation['validator_add'] == validator and
-            existing_undelegation['delegator_add'] == delegator and
-            existing_undelegation['epoch'] == undelegation['epoch']):
-
-            # Update the existing undelegation amounts
-            if existing_undelegation['final_amount'] != atto_to_one(undelegation['amount']):
-                print(f"Updating Validator {validator} delegator {delegator} epoch {undelegation['epoch']} to {atto_to_one(undelegation['amount'])}")
-                existing_undelegation['final_amount'] = atto_to_one(undelegation['amount'])
-            return
-
-    # If not found, add a new undelegation to the list
+    existing_undelegation = undelegation_ledger.get(key)
+    if existing_undelegation is not None:
+        # Update the existing undelegation amounts
+        if existing_undelegation['final_amount'] != atto_to_one(undelegation['amount']):
+            print(f"Updating Validator {validator} delegator {delegator} epoch {undelegation['epoch']} to {atto_to_one(undelegation['amount'])}")
+            existing_undelegation['final_amount'] = atto_to_one(undelegation['amount'])
+        return
+
+    # If not found, add a new undelegation to the ledger
     undelegation = {
             'validator_add': validator,
             'delegator_add': delegator,
@@ -105,15 +216,68 @@ def add_undelegation(validator, delegator, undelegation):
             'malicious' : False # assumed false
         }
     all_pending_undelegation.append(undelegation)
-
-# 1673 is the HIP30 with start of mimimum 7%
-# 1733 is the maxrate epoch where we wanted wanted to fix the max_rate for validator below 7%
-# which introduce the issue of validator with 107%
-for epoch in range(1733, 1974):
+    undelegation_ledger[key] = undelegation
+    open_undelegations.setdefault(validator, {})[key] = undelegation
+
+# index the delegations of a validator by delegator address
+# returns {delegator address: set of its pending undelegation epochs}, the first delegation of a delegator wins
+def undelegation_epochs_by_delegator(delegations):
+    epochs = {}
+    for delegation in delegations:
+        if delegation['delegator-address'] not in epochs:
+            epochs[delegation['delegator-address']] = {undelegation['epoch'] for undelegation in delegation['undelegations']}
+    return epochs
+
+def get_all_high_fee_validators_at_epoch(epoch):
     # get all validator information for epoch
     last_block_of_epoch = blockchain.epoch_last_block(epoch=epoch, endpoint=harmony_rpc_url)
     # we use last_block_of_epoch -1 because last_block_of_epoch have the next epoch info instead
-    all_validators_at_epoch = get_all_high_fee_validators_at_block(last_block_of_epoch - 1)
+    return get_all_high_fee_validators_at_block(last_block_of_epoch - 1)
+
+# yields (epoch, high fee validators at epoch) in epoch order
+# epochs are fetched concurrently, up to 2 * epoch_workers ahead of the consumer
+def prefetch_high_fee_validators(epochs):
+    with ThreadPoolExecutor(max_workers=epoch_workers) as executor:
+        pending = deque()
+        for epoch in epochs:
+            pending.append((epoch, executor.submit(get_all_high_fee_validators_at_epoch, epoch)))
+            if len(pending) >= 2 * epoch_workers:
+                epoch, future = pending.popleft()
+                yield epoch, future.result()
+        while pending:
+            epoch, future = pending.popleft()
+            yield epoch, future.result()
+
+# the ledger state after walking the epochs start_epoch to last_epoch
+# written after every epoch so an interrupted run resumes, and a later run only walks the newly finished epochs
+def save_checkpoint(start_epoch, last_epoch):
+    with open(f"{args.checkpoint}.tmp", 'w') as file:
+        json.dump({'start_epoch': start_epoch, 'last_epoch': last_epoch, 'ledger': all_pending_undelegation}, file)
+    os.replace(f"{args.checkpoint}.tmp", args.checkpoint)
+
+# restore the ledger and its indexes from the checkpoint, returns the last epoch walked or None
+def load_checkpoint(start_epoch, last_epoch):
+    if not os.path.exists(args.checkpoint):
+        return None
+    with open(args.checkpoint, 'r') as file:
+        checkpoint = json.load(file)
+    if checkpoint['start_epoch'] != start_epoch or checkpoint['last_epoch'] > last_epoch:
+        print(f"Ignoring {args.checkpoint} of epochs {checkpoint['start_epoch']} to {checkpoint['last_epoch']}")
+        return None
+
+    for undelegation in checkpoint['ledger']:
+        key = (undelegation['validator_add'], undelegation['delegator_add'], undelegation['epoch'])
+        all_pending_undelegation.append(undelegation)
+        undelegation_ledger[key] = undelegation
+        if undelegation['epoch_cleared'] == 0:
+            open_undelegations.setdefault(undelegation['validator_add'], {})[key] = undelegation
+    print(f"Resumed from {args.checkpoint} at epoch {checkpoint['last_epoch']}")
+    return checkpoint['last_epoch']
+
+resumed_epoch = load_checkpoint(args.start_epoch, args.last_epoch)
+first_epoch = args.start_epoch if resumed_epoch is None else resumed_epoch + 1
+
+for epoch, all_validators_at_epoch in prefetch_high_fee_validators(range(first_epoch, args.last_epoch + 1)):
     # for all >93% max rate validator
     for validator in all_validators_at_epoch:
         # get the pending undelegation object for the validators in all_validators_at_epoch
@@ -124,19 +288,17 @@ for epoch in range(1733, 1974):
         # for each new epoch and each validator
         # check whether the existing pending undelegation was cleared
         # if yes register the epoch
-        for existing_pending in all_pending_undelegation:
-            if (existing_pending['validator_add'] == validator_add and
-                    existing_pending['epoch_cleared'] == 0):
+        validator_open_undelegations = open_undelegations.get(validator_add, {})
+        if validator_open_undelegations:
+            epochs_by_delegator = undelegation_epochs_by_delegator(validator_delegations_list)
+            for key, existing_pending in list(validator_open_undelegations.items()):
                 # find the delegation object matching the epoch
-                delegation_at_epoch = [delegation for delegation in validator_delegations_list
-                    if existing_pending['delegator_add'] == delegation['delegator-address']]
-                if len(delegation_at_epoch) != 0:
-                    undelegation_at_epoch = [undelegation for undelegation in delegation_at_epoch[0]['undelegations']
-                        if undelegation['epoch'] == existing_pending['epoch']]
-                    if len(undelegation_at_epoch) == 0: # existing_pending_undelegation not found
-                        print(f"Delegator {existing_pending['delegator_add']} with Validator {existing_pending['validator_add']} "
-                            f"of final_amount {existing_pending['final_amount']} was cleared at {epoch} (before {existing_pending['epoch']})")
-                        existing_pending['epoch_cleared'] = epoch
+                undelegation_epochs = epochs_by_delegator.get(existing_pending['delegator_add'])
+                if undelegation_epochs is not None and existing_pending['epoch'] not in undelegation_epochs: # existing_pending_undelegation not found
+                    print(f"Delegator {existing_pending['delegator_add']} with Validator {existing_pending['validator_add']} "
+                        f"of final_amount {existing_pending['final_amount']} was cleared at {epoch} (before {existing_pending['epoch']})")
+                    existing_pending['epoch_cleared'] = epoch
+                    del validator_open_undelegations[key]
 
         # validator who became inactive doesn't trigger the bug after the undelegation
 
@@ -147,16 +309,25 @@ for epoch in range(1733, 1974):
             for undelegation in pending_undelegations_list_at_epoch:
                 add_undelegation(validator_add, delegator_add, undelegation)
 
+    save_checkpoint(args.start_epoch, epoch)
+
 # check if any pending undelegation was cleared in the recent epoch and detect malicious address
-recent_epoch=1975
-last_block_of_epoch = blockchain.epoch_last_block(epoch=recent_epoch, endpoint=harmony_rpc_url)
-recent_all_validators_at_epoch = get_all_high_fee_validators_at_block(last_block_of_epoch - 1)
+recent_epoch=args.recent_epoch
+recent_all_validators_at_epoch = get_all_high_fee_validators_at_epoch(recent_epoch)
 
 # a legit delegator would haven't tried to delegate and zero-out a pending undelegation
 # a malicious actor would to delegate and remove the pending undelegation the final amount is below
 # the original or the pending undelegation completely disappeared
 # at a recent epoch where the bug is not yet fixed, the pending undelegation should be untouched
 
+# recent validator infos by validator address
+recent_validators_by_address = {}
+for validator in recent_all_validators_at_epoch:
+    recent_validators_by_address.setdefault(validator['validator']['address'], []).append(validator)
+
+# recent delegations per validator address, by delegator address (first delegation of a delegator wins)
+recent_delegations_by_validator = {}
+
 for undelegation in all_pending_undelegation:
     # check if the undelegation was cleared
     if (undelegation['epoch_cleared'] != 0 and
@@ -168,8 +339,7 @@ for undelegation in all_pending_undelegation:
 
     undelegation_found = False
     # Get the validator info associated to the delegator
-    validator_recent_info = [validator for validator in recent_all_validators_at_epoch
-        if validator['validator']['address'] == undelegation["validator_add"]]
+    validator_recent_info = recent_validators_by_address.get(undelegation["validator_add"], [])
 
     if len(validator_recent_info) != 1:
         if len(validator_recent_info) == 0:
@@ -182,16 +352,20 @@ for undelegation in all_pending_undelegation:
     #print(json.dumps(validator_recent_info))
     validator_addr = validator_recent_info['address']
 
-    delegator_delegation = [delegation for delegation in validator_recent_info['delegations']
-            if delegation['delegator-address'] == undelegation['delegator_add']]
+    if validator_addr not in recent_delegations_by_validator:
+        delegations_by_delegator = {}
+        for delegation in validator_recent_info['delegations']:
+            delegations_by_delegator.setdefault(delegation['delegator-address'], delegation)
+        recent_delegations_by_validator[validator_addr] = delegations_by_delegator
+    delegator_delegation = recent_delegations_by_validator[validator_addr].get(undelegation['delegator_add'])
 
     delegator_addr = undelegation['delegator_add']
 
-    if len(delegator_delegation) == 0:
+    if delegator_delegation is None:
         print("next delegation but should never hit here")
         continue
     else:
-        recent_undelegations = delegator_delegation[0]['undelegations']
+        recent_undelegations = delegator_delegation['undelegations']
         for recent_undelegation in recent_undelegations:
             if recent_undelegation['epoch'] == undelegation['epoch']:
                 undelegation_found = True
@@ -3,6 +3,8 @@ import json
 import sys
 import re
 import os
+import bisect
+from functools import lru_cache
 from web3 import Web3
 from pyhmy import account, blockchain, transaction
 from pyhmy.util import convert_hex_to_one
@@ -12,6 +14,11 @@ from eth_abi import decode
 HARMONY_RPC_URL = "https://a.api.s0.t.hmny.io"
 staking_contract = "one1qqqqqqqqqqqqqqqqqqqqqqqqqqqqqq8uuuycsy"
 FOURBYTE_API_URL = "https://www.4byte.directory/api/v1/signatures/"
+# max requests per JSON-RPC batch
+RPC_BATCH_SIZE = 100
+# lookup caches shared by every address, kept across runs
+EPOCH_LAST_BLOCKS_FILE = "staking-txs/epoch-last-blocks.json"
+RECEIPT_STATUS_FILE = "staking-txs/receipt-status.json"
 
 
 def atto_to_one(atto_amount):
@@ -19,6 +26,8 @@ def atto_to_one(atto_amount):
     return atto_amount / ONE
 
 # Function to get function signature info from 4byte.directory
+# Every call of a function shares its signature, so it's only looked up once
+@lru_cache(maxsize=None)
 def get_signature_info(signature):
     response = requests.get(f"{FOURBYTE_API_URL}?hex_signature={signature}")
     response_json = response.json()
@@ -75,16 +84,101 @@ def get_transaction_history(address):
         page += 1
     return transactions
 
-def get_epoch_from_block(blocknum):
+def load_cache(filename):
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, 'r') as file:
+        return json.load(file)
+
+def save_cache(cache, filename):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(f"{filename}.tmp", 'w') as file:
+        json.dump(cache, file)
+    os.replace(f"{filename}.tmp", filename)
+
+# epoch -> last block of the epoch
+# a block is in epoch e when last block of e-1 < block <= last block of e, so once the boundaries of an epoch
+# are known, every block of it is resolved without any RPC
+epoch_last_blocks = {int(epoch): block for epoch, block in load_cache(EPOCH_LAST_BLOCKS_FILE).items()}
+# tx hash -> receipt status, receipts are final once the tx is in a block
+receipt_statuses = load_cache(RECEIPT_STATUS_FILE)
+
+# Send JSON-RPC requests as batches of RPC_BATCH_SIZE
+# Take a list of (method, params), returns the results in order, None for the requests that failed
+def batch_rpc_request(calls):
+    results = []
+    for i in range(0, len(calls), RPC_BATCH_SIZE):
+        batch = [{"jsonrpc": "2.0", "id": j, "method": method, "params": params}
+            for j, (method, params) in enumerate(calls[i:i + RPC_BATCH_SIZE])]
+        try:
+            reply = requests.post(HARMONY_RPC_URL, json=batch, timeout=120).json()
+        except (requests.exceptions.RequestException, ValueError) as err:
+            print(f"Error in batch request: {err}")
+            reply = None
+        replies = {r.get('id'): r.get('result') for r in reply if isinstance(r, dict)} if isinstance(reply, list) else {}
+        results.extend(replies.get(j) for j in range(len(batch)))
+    return results
+
+def fetch_epoch_from_block(blocknum):
     block = blockchain.get_block_by_number(block_num=blocknum,
         full_tx=False, include_tx=False,
         include_staking_tx=False, endpoint=HARMONY_RPC_URL)
     return block.get('epoch', 0)
 
-def get_tx_hash_receipt_status(tx_hash):
+def fetch_tx_hash_receipt_status(tx_hash):
     tx_receipt = transaction.get_transaction_receipt(tx_hash, HARMONY_RPC_URL)
     return tx_receipt.get('status', 0)
 
+# Returns {block number: epoch} of the blocks
+# Blocks are first resolved from the known epoch boundaries, the others are fetched in batches,
+# and the boundaries of their epochs are learned for the next lookups
+def resolve_epochs(blocknums):
+    def from_boundaries():
+        epochs = sorted(epoch_last_blocks)
+        last_blocks = [epoch_last_blocks[epoch] for epoch in epochs]
+        resolved = {}
+        for blocknum in set(blocknums):
+            i = bisect.bisect_left(last_blocks, blocknum)
+            if 0 < i < len(epochs) and epochs[i - 1] == epochs[i] - 1:
+                resolved[blocknum] = epochs[i]
+        return resolved
+
+    resolved = from_boundaries()
+    misses = sorted(set(blocknums) - set(resolved))
+    if not misses:
+        return resolved
+
+    blocks = batch_rpc_request([("hmyv2_getBlockByNumber", [blocknum, {"inclTx": False, "fullTx": False, "inclStaking": False}])
+        for blocknum in misses])
+    for blocknum, block in zip(misses, blocks):
+        resolved[blocknum] = block.get('epoch', 0) if block is not None else fetch_epoch_from_block(blocknum)
+
+    new_epochs = sorted({epoch for e in set(resolved[blocknum] for blocknum in misses) for epoch in (e - 1, e)
+        if epoch >= 0 and epoch not in epoch_last_blocks})
+    last_blocks = batch_rpc_request([("hmyv2_epochLastBlock", [epoch]) for epoch in new_epochs])
+    for epoch, last_block in zip(new_epochs, last_blocks):
+        if last_block is not None:
+            epoch_last_blocks[epoch] = int(last_block)
+    if new_epochs:
+        save_cache(epoch_last_blocks, EPOCH_LAST_BLOCKS_FILE)
+    return resolved
+
+# Returns {tx hash: receipt status} of the txs, the uncached ones are fetched in batches
+def resolve_receipt_statuses(tx_hashes):
+    misses = [tx_hash for tx_hash in dict.fromkeys(tx_hashes) if tx_hash not in receipt_statuses]
+    receipts = batch_rpc_request([("hmyv2_getTransactionReceipt", [tx_hash]) for tx_hash in misses])
+    for tx_hash, receipt in zip(misses, receipts):
+        receipt_statuses[tx_hash] = receipt.get('status', 0) if receipt is not None else fetch_tx_hash_receipt_status(tx_hash)
+    if misses:
+        save_cache(receipt_statuses, RECEIPT_STATUS_FILE)
+    return {tx_hash: receipt_statuses[tx_hash] for tx_hash in tx_hashes}
+
+def get_epoch_from_block(blocknum):
+    return resolve_epochs([blocknum])[blocknum]
+
+def get_tx_hash_receipt_status(tx_hash):
+    return resolve_receipt_statuses([tx_hash])[tx_hash]
+
 # Main function to gather all staking transactions
 def gather_staking_transactions(address):
     # file where the previous staking-tx were processed
@@ -99,13 +193,19 @@ def gather_staking_transactions(address):
 
     staking_transactions = get_staking_transaction_history(address)
     normal_transactions = get_transaction_history(address)
+    staking_contract_transactions = [tx for tx in normal_transactions if tx['to'] == staking_contract]
+
+    # resolve the epoch & receipt status of every transaction at once, many share a block
+    transactions = staking_transactions + staking_contract_transactions
+    epochs = resolve_epochs([tx['blockNumber'] for tx in transactions])
+    statuses = resolve_receipt_statuses([tx['hash'] for tx in transactions])
 
     all_transactions = []
 
     for tx in staking_transactions:
         msg=tx['msg']
-        epoch = get_epoch_from_block(tx['blockNumber'])
-        status = get_tx_hash_receipt_status(tx['hash'])
+        epoch = epochs[tx['blockNumber']]
+        status = statuses[tx['hash']]
         all_transactions.append({
             'amount': atto_to_one(msg.get('amount', 0)),
             'delegator_add': msg.get('delegatorAddress', None),
@@ -137,8 +237,8 @@ def gather_staking_transactions(address):
                     validator_add = convert_hex_to_one(decoded_parameters[1][2:])
 
                 if decoded_parameters:
-                    epoch = get_epoch_from_block(tx['blockNumber'])
-                    status = get_tx_hash_receipt_status(tx['hash'])
+                    epoch = epochs[tx['blockNumber']]
+                    status = statuses[tx['hash']]
                     all_transactions.append({
                         'amount': amount,
                         'delegator_add': delegator_add,
@@ -1,13 +1,22 @@
 import time
 import json
+import heapq
+import os
+import random
+import sys
+from array import array
 import argparse
 from pyhmy import blockchain
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 # Script will return the last miners before the next unsual block time (ie more than 2s)
-# output will be in json format
+# output will be in json format (miners.json), blocks numbers, timestamps and miners are dumped to
+# blocks_time.bin (see BlockTimeSeries.dump/load), with --miner-stats per miner analytics go to miner_stats.json
 # Usage: python3 unsual-block-delay.py <start_block> <end_block> --num_threads <num_threads>
 # Example: python3 unsual-block-delay.py 1000 2000 --num_threads 100
+# Blocks can be kept in a local store shared with get_blockchain.py, so re-runs only fetch missing blocks:
+#          python3 unsual-block-delay.py 1000 2000 --block-store blocks.db
 
 def write_dict_to_disk(data, filename):
     """
@@ -20,84 +29,312 @@ def write_dict_to_disk(data, filename):
     with open(filename, 'w') as file:
         json.dump(data, file)
 
-def get_blocks_with_retries(start_block, end_block, endpoint, retries):
+def normalize_block(block):
     """
-    Retrieves the blocks within the specified range, with retries in case of failure.
+    Converts the block number and timestamp to integers.
+    Blocks stored by get_blockchain.py come from the v1 RPC which returns them as hex strings.
+
+    Args:
+        block (dict): The block dictionary, updated in place.
+
+    Returns:
+        dict: The block dictionary.
+    """
+    for key in ('number', 'timestamp'):
+        if isinstance(block[key], str):
+            block[key] = int(block[key], 16)
+    return block
+
+def get_blocks(start_block, end_block, endpoint):
+    """
+    Retrieves the blocks within the specified range (single attempt, retries are handled by the scheduler).
     Args:
         start_block (int): The starting block number.
         end_block (int): The ending block number.
         endpoint (str): The blockchain endpoint to query.
-        retries (int): The number of retry attempts for failed requests.
     Returns:
         list: A list of block dictionaries.
     """
-    for attempt in range(retries):
-        try:
-            return blockchain.get_blocks(start_block=start_block, end_block=end_block, full_tx=False, include_tx=False, include_staking_tx=False, include_signers=False, endpoint=endpoint)
-        except Exception as e:
-            if attempt < retries - 1:
-                print(f"Blocks {start_block} to {end_block} retrieval failed: {e}. {attempt + 1} time(s) retried.")
-                time.sleep(1)  # Wait for 1 second before retrying
-            else:
-                raise e
+    return blockchain.get_blocks(start_block=start_block, end_block=end_block, full_tx=False, include_tx=False, include_staking_tx=False, include_signers=False, endpoint=endpoint)
 
-def fetch_all_blocks(endpoint, start_block, end_block, retries, num_threads):
+def backoff_delay(attempt, base=0.5, cap=30):
     """
-    Retrieves all blocks within the specified range
+    Exponential backoff with full jitter.
+
+    Args:
+        attempt (int): The number of failed attempts so far (0 for the first retry).
+        base (float, optional): The delay of the first retry in seconds. Defaults to 0.5.
+        cap (float, optional): The maximum delay in seconds. Defaults to 30.
+
+    Returns:
+        float: A random delay between 0 and min(cap, base * 2^attempt) seconds.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+class AdaptiveScheduler:
+    """
+    Schedules block range requests, tuning the number of in-flight requests and the chunk size
+    from the observed latency and errors (AIMD):
+      - a successful request increases the concurrency by 1 per "window" of requests, and moves the chunk
+        size towards the size that would take `target_latency` seconds
+      - a failed or very slow (more than twice `target_latency`) request halves the concurrency and the chunk size
+    Failed requests are retried after an exponential backoff with jitter.
+    """
+
+    def __init__(self, max_concurrency, target_latency=5.0, min_chunk=50, max_chunk=1000, initial_concurrency=4):
+        """
+        Args:
+            max_concurrency (int): The maximum number of in-flight requests.
+            target_latency (float, optional): The request latency to aim for in seconds. Defaults to 5.
+            min_chunk (int, optional): The minimum number of blocks per request. Defaults to 50.
+            max_chunk (int, optional): The maximum number of blocks per request. Defaults to 1000.
+            initial_concurrency (int, optional): The number of in-flight requests to start with. Defaults to 4.
+        """
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.min_chunk = min_chunk
+        self.max_chunk = max_chunk
+        self.concurrency = float(min(initial_concurrency, max_concurrency))
+        self.chunk_size = float(max_chunk)
+        self.requests = 0
+        self.errors = 0
+
+    def on_success(self, latency, size):
+        self.requests += 1
+        if latency > 2 * self.target_latency:
+            self._decrease()
+            return
+        self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+        ideal_chunk = size * self.target_latency / max(latency, 0.001)
+        self.chunk_size = min(self.max_chunk, max(self.min_chunk, (self.chunk_size + ideal_chunk) / 2))
+
+    def on_error(self):
+        self.requests += 1
+        self.errors += 1
+        self._decrease()
+
+    def _decrease(self):
+        self.concurrency = max(1.0, self.concurrency / 2)
+        self.chunk_size = max(self.min_chunk, self.chunk_size / 2)
+
+    def run(self, fetch_range, ranges, retries):
+        """
+        Fetches the given block ranges, yielding the results in block order.
+
+        Completed chunks wait in a small reorder buffer until all the chunks before them are done, and new
+        chunks are only dispatched within a window (a couple of "windows" of requests) of the oldest unfinished
+        chunk, so the buffer stays bounded whatever the size of the ranges.
+
+        Args:
+            fetch_range (callable): Called with (start_block, end_block), returns the list of blocks.
+            ranges (list): The (start_block, end_block) inclusive ranges to fetch, in ascending order.
+            retries (int): The number of attempts for each request.
+
+        Yields:
+            tuple: (start_block, end_block, blocks), blocks being the exception of the last attempt if all failed.
+        """
+        pending = deque(ranges)
+        retry_heap = []  # (ready time, start block, end block, attempt)
+        in_flight = {}
+        completed = []  # reorder buffer heap of (start block, end block, blocks)
+
+        def oldest_unfinished():
+            starts = [start for start, _, _, _ in in_flight.values()] + [start for _, start, _, _ in retry_heap]
+            if pending:
+                starts.append(pending[0][0])
+            return min(starts) if starts else None
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            while pending or retry_heap or in_flight:
+                while len(in_flight) < int(self.concurrency):
+                    oldest = oldest_unfinished()
+                    window = 2 * int(self.concurrency) * int(self.chunk_size)
+                    if retry_heap and retry_heap[0][0] <= time.monotonic():
+                        _, start_block, end_block, attempt = heapq.heappop(retry_heap)
+                    elif pending and pending[0][0] < oldest + window:
+                        start_block, last_block = pending.popleft()
+                        end_block = min(last_block, start_block + int(self.chunk_size) - 1)
+                        if end_block < last_block:
+                            pending.appendleft((end_block + 1, last_block))
+                        attempt = 0
+                    else:
+                        break
+                    future = executor.submit(fetch_range, start_block, end_block)
+                    in_flight[future] = (start_block, end_block, attempt, time.monotonic())
+                timeout = max(0.0, retry_heap[0][0] - time.monotonic()) if retry_heap else None
+                if not in_flight:
+                    time.sleep(timeout)
+                    continue
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start_block, end_block, attempt, started = in_flight.pop(future)
+                    try:
+                        blocks = future.result()
+                    except Exception as e:
+                        self.on_error()
+                        if attempt < retries - 1:
+                            print(f"Blocks {start_block} to {end_block} retrieval failed: {e}. {attempt + 1} time(s) retried.")
+                            heapq.heappush(retry_heap, (time.monotonic() + backoff_delay(attempt), start_block, end_block, attempt + 1))
+                        else:
+                            heapq.heappush(completed, (start_block, end_block, e))
+                        continue
+                    self.on_success(time.monotonic() - started, end_block - start_block + 1)
+                    heapq.heappush(completed, (start_block, end_block, blocks))
+                oldest = oldest_unfinished()
+                while completed and (oldest is None or completed[0][0] < oldest):
+                    yield heapq.heappop(completed)
+
+def iter_blocks(endpoint, start_block, end_block, retries, num_threads, store=None, shard=0, level=0):
+    """
+    Yields all blocks within the specified range in ascending order, as they are retrieved with an
+    adaptive number of in-flight requests and chunk size (see AdaptiveScheduler).
     Args:
         endpoint (str): The blockchain endpoint to query.
         start_block (int): The starting block number.
         end_block (int): The ending block number.
         retries (int): The number of retry attempts for failed requests.
-        num_threads (int): The number of threads to use for parallel block retrieval.
-    Returns:
-        list: A list of block dictionaries.
+        num_threads (int): The maximum number of in-flight requests for parallel block retrieval.
+        store (BlockStore, optional): Local block store, only the blocks missing from it are fetched.
+        shard (int, optional): The shard of the endpoint, used as the block store key. Defaults to 0.
+        level (int, optional): The block store detail level of the fetched blocks (BlockStore.HEADER). Defaults to 0.
+    Yields:
+        dict: The block dictionaries.
     """
-    blocks = []
-    with ThreadPoolExecutor(max_workers=num_threads) as executor:
-        future_to_block_range = {}
-        for block_num in range(start_block, end_block + 1, 1000):
-            range_end_block = min(block_num + 999, end_block)
-            future = executor.submit(get_blocks_with_retries, block_num, range_end_block, endpoint, retries)
-            future_to_block_range[future] = (block_num, range_end_block)
-            #print(f"Blocks {block_num} to {range_end_block} retrieval scheduled.")
-
-        for future in as_completed(future_to_block_range):
-            block_range = future_to_block_range[future]
-            try:
-                block_list = future.result()
-                blocks.extend(block_list)
-                #print(f"Blocks {block_range[0]} to {block_range[1]} retrieved successfully. added {len(block_list)} blocks.")
-            except Exception as e:
-                print(f"Blocks {block_range[0]} to {block_range[1]} retrieval failed: {e}")
-    return blocks
-
-def calculate_block_time_diffs(blocks):
-    """
-    Calculates the time differences between consecutive blocks.
+    ranges = store.gaps(shard, level, start_block, end_block) if store else [(start_block, end_block)]
+    scheduler = AdaptiveScheduler(num_threads)
+    fetch_range = lambda range_start_block, range_end_block: get_blocks(range_start_block, range_end_block, endpoint)
+    cursor = start_block
+    for range_start_block, range_end_block, block_list in scheduler.run(fetch_range, ranges, retries):
+        if store and cursor < range_start_block:
+            yield from (normalize_block(block) for block in store.blocks(shard, cursor, range_start_block - 1))
+        cursor = range_end_block + 1
+        if isinstance(block_list, Exception):
+            print(f"Blocks {range_start_block} to {range_end_block} retrieval failed: {block_list}")
+            continue
+        if store:
+            store.put(shard, level, [(block['number'], block) for block in block_list])
+        yield from sorted(block_list, key=lambda block: block['number'])
+    if store and cursor <= end_block:
+        yield from (normalize_block(block) for block in store.blocks(shard, cursor, end_block))
+    print(f"Fetched with {scheduler.requests} requests ({scheduler.errors} failed), "
+          f"final concurrency {int(scheduler.concurrency)} and chunk size {int(scheduler.chunk_size)}")
 
-    Args:
-        blocks (list): A list of block dictionaries.
+class BlockTimeSeries:
+    """
+    Compact time series of blocks, as parallel arrays of block numbers, timestamps and miners
+    interned to small integers (20 bytes per block).
+    """
 
-    Returns:
-        list: A list of dictionaries with block numbers and their time differences with the next block.
-    """
-    block_time_diffs = []
-    for i in range(len(blocks) - 1):
-        current_block = blocks[i]
-        next_block = blocks[i + 1]
-        time_diff = next_block['timestamp'] - current_block['timestamp']
-        if time_diff > 10 or time_diff < -10:
-            print(f"Block {current_block['number']} to {next_block['number']} has unusual time difference: {time_diff} seconds")
-            print(f"  Current Block {current_block['number']} timestamp: {current_block['timestamp']}")
-            print(f"  Next Block {next_block['number']} timestamp: {next_block['timestamp']}")
-        block_time_diffs.append({current_block['number']: time_diff})
-    return block_time_diffs
-
-def get_last_miners_between_blocks(endpoint, start_block, end_block, threshold=2, retries=10, num_threads=10):
+    def __init__(self):
+        self.numbers = array('q')
+        self.timestamps = array('q')
+        self.miner_ids = array('i')
+        self.miners = []
+        self.miner_index = {}
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def append(self, number, timestamp, miner):
+        """
+        Appends a block, blocks are expected in ascending order.
+
+        Args:
+            number (int): The block number.
+            timestamp (int): The block timestamp in seconds.
+            miner (str): The block miner address.
+        """
+        miner_id = self.miner_index.get(miner)
+        if miner_id is None:
+            miner_id = self.miner_index[miner] = len(self.miners)
+            self.miners.append(miner)
+        self.numbers.append(number)
+        self.timestamps.append(timestamp)
+        self.miner_ids.append(miner_id)
+
+    def dump(self, filename):
+        """
+        Writes the series to a file: a JSON header line (length, byte order, miners) followed by the raw columns.
+
+        Args:
+            filename (str): The name of the file to write the series to.
+        """
+        header = {'version': 1, 'length': len(self), 'byteorder': sys.byteorder, 'miners': self.miners}
+        with open(filename, 'wb') as file:
+            file.write(json.dumps(header).encode() + b'\n')
+            for column in (self.numbers, self.timestamps, self.miner_ids):
+                column.tofile(file)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Reads a series written by dump().
+
+        Args:
+            filename (str): The name of the file to read the series from.
+
+        Returns:
+            BlockTimeSeries: The loaded series.
+        """
+        series = cls()
+        with open(filename, 'rb') as file:
+            header = json.loads(file.readline())
+            for column in (series.numbers, series.timestamps, series.miner_ids):
+                column.fromfile(file, header['length'])
+                if header['byteorder'] != sys.byteorder:
+                    column.byteswap()
+        series.miners = header['miners']
+        series.miner_index = {miner: miner_id for miner_id, miner in enumerate(series.miners)}
+        return series
+
+class BlockTimeAnalyzer:
+    """
+    Consumes blocks in ascending order into a BlockTimeSeries, and computes on the fly the miners
+    of the blocks followed by a time difference above the threshold.
+    """
+
+    def __init__(self, threshold=2):
+        """
+        Args:
+            threshold (int, optional): The maximum allowed time difference between blocks in seconds. Defaults to 2.
+        """
+        self.threshold = threshold
+        self.series = BlockTimeSeries()
+        self.miner_blocks = {}
+
+    def add(self, block):
+        """
+        Adds the next block (by number) to the analysis.
+
+        Args:
+            block (dict): The block dictionary.
+        """
+        series = self.series
+        if len(series):
+            current_number, current_timestamp = series.numbers[-1], series.timestamps[-1]
+            time_diff = block['timestamp'] - current_timestamp
+            if time_diff > 10 or time_diff < -10:
+                print(f"Block {current_number} to {block['number']} has unusual time difference: {time_diff} seconds")
+                print(f"  Current Block {current_number} timestamp: {current_timestamp}")
+                print(f"  Next Block {block['number']} timestamp: {block['timestamp']}")
+            if time_diff > self.threshold:
+                miner = series.miners[series.miner_ids[-1]]
+                self.miner_blocks.setdefault(miner, []).append({current_number: time_diff})
+        series.append(block['number'], block['timestamp'], block['miner'])
+
+    def last_miners(self):
+        """
+        Returns:
+            dict: The miners with their blocks followed by an unusual block time, latest blocks first.
+        """
+        miner_blocks = {miner: list(reversed(blocks)) for miner, blocks in self.miner_blocks.items()}
+        return dict(sorted(miner_blocks.items(), key=lambda item: -list(item[1][0].keys())[0]))
+
+def get_last_miners_between_blocks(endpoint, start_block, end_block, threshold=2, retries=10, num_threads=10, store=None, shard=0, level=0):
     """
     Retrieves the list of miners for blocks between the specified start and end blocks,
     stopping when the time difference between blocks exceeds the given threshold.
+    Blocks are processed as they are retrieved, only their number, timestamp and miner are kept.
 
     Args:
         endpoint (str): The blockchain endpoint to query.
@@ -106,79 +343,166 @@ def get_last_miners_between_blocks(endpoint, start_block, end_block, threshold=2
         threshold (int, optional): The maximum allowed time difference between
                                    blocks in seconds. Defaults to 2.
         retries (int, optional): The number of retry attempts for failed requests. Defaults to 10.
-        num_threads (int, optional): The number of threads to use for parallel block retrieval. Defaults to 10.
+        num_threads (int, optional): The maximum number of in-flight requests for parallel block retrieval. Defaults to 10.
+        store (BlockStore, optional): Local block store to read blocks from and save fetched blocks to.
+        shard (int, optional): The shard of the endpoint. Defaults to 0.
+        level (int, optional): The block store detail level of the fetched blocks (BlockStore.HEADER). Defaults to 0.
 
     Returns:
-        list: A list of miner addresses for the blocks within the specified range.
+        tuple: The miners with their blocks followed by an unusual block time, and the BlockTimeSeries of the blocks.
     """
-    blocks = fetch_all_blocks(endpoint, start_block, end_block, retries, num_threads)
-    blocks.sort(key=lambda x: x['number'], reverse=False)
-    blocks_time = calculate_block_time_diffs(blocks)
+    analyzer = BlockTimeAnalyzer(threshold)
+    for block in iter_blocks(endpoint, start_block, end_block, retries, num_threads, store, shard, level):
+        analyzer.add(block)
 
-    if len(blocks) < 2:
+    if len(analyzer.series) < 2:
         raise ValueError("At least 2 blocks are required to calculate time differences.")
 
-    last_block_time = blocks[-1]['timestamp']
-
-    # miner with blocks with unusual block time
-    miner_blocks = {}
-
-    for block in reversed(blocks):
-        block_time = block['timestamp']
-        time_diff = last_block_time - block_time
-
-        if time_diff > threshold:
-            miner = block['miner']
-            if miner not in miner_blocks:
-                miner_blocks[miner] = []
-            miner_blocks[miner].append({block['number']: time_diff})
+    return analyzer.last_miners(), analyzer.series
 
-        last_block_time = block_time
 
-    return miner_blocks, blocks_time
-
-
-def analyze_block_production(blocks, normal_block_time=2):
+def analyze_block_production(series, normal_block_time=2):
     """
     Analyzes the block production and prints statistics.
 
     Args:
-        blocks (list): A list of dictionaries with block numbers and their time differences.
+        series (BlockTimeSeries): The time series of the blocks.
         normal_block_time (int, optional): The normal block time in seconds. Defaults to 2.
     """
-    # Time margin to consider a block as unusual
-    # 1.1 for a 10% margin
-    # commented due to lack of time precision to ms
-    # time_margin = 1.1
-
-    total_blocks = len(blocks)
+    # number of time differences, ie of blocks followed by another block
+    total_blocks = len(series) - 1
     if total_blocks < 2:
         print("Not enough blocks to analyze.")
         return
 
-    total_time = sum(list(block.values())[0] for block in blocks)
+    # the time differences between consecutive blocks add up to the time between the first and last blocks
+    total_time = series.timestamps[-1] - series.timestamps[0]
     total_time_diff = total_time - total_blocks * normal_block_time
 
-    print(f"Total blocks processed: {total_blocks} between blocks {list(blocks[0].keys())[0]} and {list(blocks[-1].keys())[0]}")
+    print(f"Total blocks processed: {total_blocks} between blocks {series.numbers[0]} and {series.numbers[-2]}")
     print(f"Total time: {total_time} seconds")
     print(f"block time: {total_time / total_blocks} (vs {normal_block_time}s)")
     print(f"Total blocks time should be : {total_blocks * normal_block_time}s")
     print(f"Total time difference: {total_time_diff} seconds")
     print(f"Missing blocks production number: {total_time_diff / normal_block_time}")
-    # commented due to lack of time precision to ms
-    #blocks_above_threshold = [block for block in blocks if list(block.values())[0] > normal_block_time * time_margin]
-    #print(f"Number of blocks with time difference above {normal_block_time}s: {len(blocks_above_threshold)}")
+
+def analyze_miners(series, normal_block_time=2, threshold=2, window=1000):
+    """
+    Computes per miner block production analytics in vectorized passes over the time series (requires numpy).
+    The time difference after a block is attributed to the miner of that block.
+
+    Args:
+        series (BlockTimeSeries): The time series of the blocks.
+        normal_block_time (int, optional): The normal block time in seconds. Defaults to 2.
+        threshold (int, optional): The time difference above which a block is slow, in seconds. Defaults to 2.
+        window (int, optional): The number of blocks per window of the rolling view. Defaults to 1000.
+
+    Returns:
+        dict: Per miner stats (block count, slow block count, p50/p95/p99/max time difference, missed blocks),
+              per window stats (missed blocks, slow blocks, and the miner who missed the most) and the
+              worst rolling window of `window` blocks, None if numpy is not installed.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        print("[!] --miner-stats requires numpy: python3 -m pip install numpy")
+        return None
+
+    numbers = np.frombuffer(series.numbers, dtype=np.int64)[:-1]
+    time_diffs = np.diff(np.frombuffer(series.timestamps, dtype=np.int64))
+    miner_ids = np.frombuffer(series.miner_ids, dtype=np.int32)[:-1]
+    missed = np.maximum(time_diffs - normal_block_time, 0) / normal_block_time
+    slow = time_diffs > threshold
+
+    # per miner, on the time differences sorted by miner then value
+    order = np.lexsort((time_diffs, miner_ids))
+    sorted_ids, sorted_diffs = miner_ids[order], time_diffs[order]
+    starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+    counts = np.diff(np.r_[starts, len(sorted_ids)])
+
+    def percentile(q):
+        # linear interpolation between closest ranks, as numpy.percentile
+        position = starts + (counts - 1) * q / 100
+        low, high = np.floor(position).astype(np.int64), np.ceil(position).astype(np.int64)
+        return sorted_diffs[low] + (sorted_diffs[high] - sorted_diffs[low]) * (position - low)
+
+    miner_group = sorted_ids[starts]
+    columns = {
+        'blocks': counts,
+        'slow_blocks': np.add.reduceat(slow[order].astype(np.int64), starts),
+        'p50': percentile(50),
+        'p95': percentile(95),
+        'p99': percentile(99),
+        'max': sorted_diffs[starts + counts - 1],
+        'missed_blocks': np.add.reduceat(missed[order], starts),
+    }
+    miners = {series.miners[miner_id]: {name: column[k].item() for name, column in columns.items()}
+              for k, miner_id in enumerate(miner_group.tolist())}
+
+    # per window of consecutive blocks, with the miner who missed the most blocks in it
+    window_ids = np.arange(len(time_diffs)) // window
+    window_starts = np.arange(0, len(time_diffs), window)
+    missed_by_window_miner = np.bincount(window_ids * len(series.miners) + miner_ids, weights=missed,
+                                         minlength=len(window_starts) * len(series.miners)).reshape(len(window_starts), -1)
+    worst_miners = missed_by_window_miner.argmax(axis=1)
+    windows = [{
+        'first_block': first_block,
+        'last_block': last_block,
+        'missed_blocks': window_missed,
+        'slow_blocks': window_slow,
+        'worst_miner': series.miners[worst_miner] if worst_missed > 0 else None,
+        'worst_miner_missed_blocks': worst_missed,
+    } for first_block, last_block, window_missed, window_slow, worst_miner, worst_missed in zip(
+        numbers[window_starts].tolist(),
+        numbers[np.minimum(window_starts + window, len(numbers)) - 1].tolist(),
+        np.add.reduceat(missed, window_starts).tolist(),
+        np.add.reduceat(slow.astype(np.int64), window_starts).tolist(),
+        worst_miners.tolist(),
+        missed_by_window_miner[np.arange(len(window_starts)), worst_miners].tolist())]
+
+    # worst rolling window, sliding one block at a time
+    rolling = np.r_[0, np.cumsum(missed)]
+    rolling = rolling[min(window, len(missed)):] - rolling[:len(rolling) - min(window, len(missed))]
+    worst_start = int(rolling.argmax())
+    worst_window = {
+        'first_block': int(numbers[worst_start]),
+        'last_block': int(numbers[min(worst_start + window, len(numbers)) - 1]),
+        'missed_blocks': float(rolling[worst_start]),
+    }
+
+    return {'miners': miners, 'windows': windows, 'worst_window': worst_window}
+
+def print_miner_analytics(analytics, top=10):
+    """
+    Prints the miners who missed the most blocks and the worst rolling window.
+
+    Args:
+        analytics (dict): The result of analyze_miners().
+        top (int, optional): The number of miners to print. Defaults to 10.
+    """
+    miners = sorted(analytics['miners'].items(), key=lambda item: item[1]['missed_blocks'], reverse=True)
+    print(f"Top {top} miners by missed blocks production:")
+    for miner, stats in miners[:top]:
+        print(f"  {miner}: {stats['missed_blocks']:.1f} missed, {stats['slow_blocks']}/{stats['blocks']} slow blocks, "
+              f"p50 {stats['p50']:.1f}s p95 {stats['p95']:.1f}s p99 {stats['p99']:.1f}s max {stats['max']}s")
+    worst_window = analytics['worst_window']
+    print(f"Worst window: {worst_window['missed_blocks']:.1f} missed blocks between blocks "
+          f"{worst_window['first_block']} and {worst_window['last_block']}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Get last miners before unusual block time.")
     parser.add_argument("start_block", type=int, help="The starting block number.")
     parser.add_argument("end_block", type=int, help="The ending block number.")
-    parser.add_argument("--num_threads", type=int, default=100, help="The number of threads to use for parallel block retrieval.")
+    parser.add_argument("--num_threads", type=int, default=100, help="The maximum number of in-flight requests for parallel block retrieval, the actual number adapts to the endpoint latency and errors.")
     parser.add_argument("--shard", type=int, choices=[0, 1], default=0, help="The shard number to query (0 or 1).")
     parser.add_argument("--localhost", action="store_true", help="Use localhost endpoints.")
     parser.add_argument("--onesec", action="store_true", help="Use 1s block time.")
     parser.add_argument("--devnet", action="store_true", help="Use devnet endpoints.")
+    parser.add_argument("--miner-stats", action="store_true", help="Compute per miner analytics (percentiles, slow and missed blocks, rolling windows) to miner_stats.json, requires numpy.")
+    parser.add_argument("--window", type=int, default=1000, help="The number of blocks per window of the miner analytics rolling view.")
+    parser.add_argument("--block-store", help="SQLite file to keep fetched blocks in (shared with get_blockchain.py), re-runs only fetch missing blocks.")
     args = parser.parse_args()
+    assert args.window > 0
 
     if args.onesec:
         expected_block_time = 1
@@ -202,10 +526,24 @@ if __name__ == "__main__":
             else:
                 endpoint = "https://api.s1.t.hmny.io"
 
-    miners, blockstimes = get_last_miners_between_blocks(endpoint, args.start_block, args.end_block, num_threads=args.num_threads)
+    store, level = None, 0
+    if args.block_store:
+        # the block store module is shared with get_blockchain.py, only needed with --block-store
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'get_blockchain'))
+        from block_store import BlockStore
+        store, level = BlockStore(args.block_store), BlockStore.HEADER
+    miners, series = get_last_miners_between_blocks(endpoint, args.start_block, args.end_block, num_threads=args.num_threads,
+                                                    store=store, shard=args.shard, level=level)
     print("write Last miners with block before next unusual block time to file")
     write_dict_to_disk(miners, "miners.json")
-    print("write blocks time diff to file")
-    write_dict_to_disk(blockstimes, "blocks_time.json")
+    print("write blocks time series to file")
+    series.dump("blocks_time.bin")
+
+    analyze_block_production(series, expected_block_time)
 
-    analyze_block_production(blockstimes, expected_block_time)
+    if args.miner_stats:
+        analytics = analyze_miners(series, expected_block_time, window=args.window)
+        if analytics is not None:
+            print("write miner analytics to file")
+            write_dict_to_disk(analytics, "miner_stats.json")
+            print_miner_analytics(analytics)
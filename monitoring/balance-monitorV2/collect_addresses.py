@@ -1,46 +1,94 @@
 #bin/python3
 
 import argparse
-import csv, os
+import csv, os, re, sys
 import subprocess
 from glob import glob
 
 FN_PAGE = "https://harmony.one/fn-keys"
 OUT_FILE = "validating_addresses.csv"
+# Default output of --diff, which must not overwrite the address list it is diffed against
+DIFF_OUT_FILE = "validating_addresses_diff.csv"
+SHARD_COUNT = 4
 
-def collect_addresses(gen_file, out_file = OUT_FILE, write = True):
-    with open(gen_file, 'r') as f:
-        contents = [x.strip() for x in f]
+# Start of a `var X = []DeployAccount{` block, one per network in the genesis file
+BLOCK_RE = re.compile(r'var\s+(\w+)\s*=\s*\[\]DeployAccount\s*\{')
+# Account entry of a block
+ACCOUNT_RE = re.compile(r'Address:\s*"([^"]+)".*?BlsPublicKey:\s*"([0-9a-fA-F]+)"')
+
+# Stream the (network, address, shard) of every account of a genesis file, in a single pass
+# The network is the variable name of the account's block, and its shard is its BLS public key modulo `shard_count`
+def parse_genesis(lines, shard_count = SHARD_COUNT):
+    network = None
+    for line in lines:
+        block = BLOCK_RE.search(line)
+        if block:
+            network = block.group(1)
+            continue
+        account = ACCOUNT_RE.search(line)
+        if account:
+            yield network, account.group(1), int(account.group(2), 16) % shard_count
+
+# Accounts of the last network of a genesis file, as [address, shard]
+def last_network(accounts) -> list:
+    network, rows = None, []
+    for n, a, s in accounts:
+        if n != network:
+            network, rows = n, []
+        rows.append([a, s])
+    return rows
 
-    address_set = []
-    for x in contents:
-        if 'DeployAccount' in str(x):
-            address_set = []
+# Read an address list generated by collect_addresses, as [address, shard]
+def read_address_list(address_file) -> list:
+    with open(address_file, 'r') as f:
+        return [[a, int(s)] for a, s in csv.reader(f)]
+
+# Stream the changes from `previous` to `rows`, as [address, shard, "added" | "removed"]
+def diff_addresses(previous, rows):
+    removed = dict.fromkeys(tuple(r) for r in previous)
+    for a, s in rows:
+        if (a, s) in removed:
+            del removed[(a, s)]
         else:
-            if 'Index' in str(x):
-                address_set.append(x)
-    v_print(address_set)
-
-    parsed_addresses = []
-    for a in address_set:
-        tokens = str(a).split(' ')
-        v_print(tokens)
-        addr = tokens[tokens.index("Address:") + 1][1:-2]
-        shard = int('0x' + tokens[tokens.index("BlsPublicKey:") + 1][1:-3], 16) % 4
-        parsed_addresses.append([addr, shard])
-    v_print(parsed_addresses)
-
-    if write:
+            yield [a, s, "added"]
+    for a, s in removed:
+        yield [a, s, "removed"]
+
+# Write the [address, shard] of the foundational nodes of `network` (the last one of the file if None) to `out_file`
+# With a `previous` address list, only the added & removed nodes are written
+def collect_addresses(gen_file, out_file = OUT_FILE, write = True, shard_count = SHARD_COUNT, network = None, previous = None):
+    with open(gen_file, 'r') as f:
+        accounts = parse_genesis(f, shard_count)
+        if network:
+            rows = ([a, s] for n, a, s in accounts if n == network)
+        else:
+            rows = last_network(accounts)
+        if previous:
+            rows = diff_addresses(read_address_list(previous), rows)
+
+        if not write:
+            return list(rows)
+
+        count = 0
         with open(out_file, 'w') as wf:
             writer = csv.writer(wf)
-            writer.writerows(parsed_addresses)
+            for row in rows:
+                v_print(row)
+                writer.writerow(row)
+                count += 1
 
-    print("List of Foundational Node accounts & shard created!")
+    if previous:
+        print("%d Foundational Node changes since %s written!" % (count, previous))
+    else:
+        print("List of Foundational Node accounts & shard created!")
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--input-file', dest = 'input_file', default = FN_PAGE, help = "List of ONE addresses to track")
-    parser.add_argument('--out-file', dest = 'out_file', default = OUT_FILE, help = "File to dump addresses to")
+    parser.add_argument('--out-file', dest = 'out_file', default = None, help = "File to dump addresses to, %s (%s with --diff) by default" % (OUT_FILE, DIFF_OUT_FILE))
+    parser.add_argument('--shard-count', dest = 'shard_count', type = int, default = SHARD_COUNT, help = "Number of shards of the network")
+    parser.add_argument('--network', dest = 'network', default = None, help = "DeployAccount variable to read, the last one of the file by default")
+    parser.add_argument('--diff', dest = 'diff', default = None, help = "Previous address list, only write the added & removed nodes")
     parser.add_argument('--verbose', action = 'store_true', help = "Verbose for debug")
 
     args = parser.parse_args()
@@ -52,4 +100,10 @@ if __name__ == '__main__':
         def v_print(s):
             return
 
-    collect_addresses(args.input_file, args.out_file)
+    if args.out_file is None:
+        args.out_file = DIFF_OUT_FILE if args.diff else OUT_FILE
+    if args.diff and os.path.abspath(args.out_file) == os.path.abspath(args.diff):
+        print("Error: --out-file would overwrite the --diff address list %s" % args.diff)
+        sys.exit(-1)
+
+    collect_addresses(args.input_file, args.out_file, shard_count = args.shard_count, network = args.network, previous = args.diff)
@@ -5,27 +5,74 @@ import os, sys, re
 import json
 import time
 import common
+import metrics
+import requests
 import pandas as pd
-import decimal as dec
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 
-def collect_data(address_list, round, output_dir = None):
-    results = []
-    for a in address_list:
+# Collect the balance of every address, in parallel
+# Each shard endpoint has its own connection pool, bounding its concurrent requests to `shard_workers`
+# With a `batch_size` above 1, addresses are grouped by shard and sent as JSON-RPC batches
+def collect_data(address_list, round, output_dir = None, shard_workers = common.shard_workers, batch_size = common.batch_size):
+    shards = sorted(set(int(a.shard) for a in address_list))
+    sessions = {s: common.endpoint_session(common.api_base % s, shard_workers) for s in shards}
+
+    # Returns (whole ONE, atto remainder), (None, None) if the balance is unknown
+    def new_entry(a, result):
+        if result == None or "result" not in result:
+            # Transport errors are counted by common.request, count the error replies
+            if result != None:
+                metrics.rpc_errors.inc(common.api_base % int(a.shard), 'reply')
+            return (None, None)
+        return common.parse_balance(result["result"])
+
+    # Tasks are lists of (position in address list, address)
+    # A connection error or timeout only makes the balances of its task unknown
+    def collect(task):
+        (i, a), = task
         req = json.dumps(common.current_balance_request(a.address))
-        result = common.request(common.api_base % int(a.shard), req)
-        new_entry = {"address": a.address, "shard": a.shard, "index": round}
-        if result == None:
-            new_entry["balance"] = dec.Decimal('NAN')
-        else:
-            new_entry["balance"] = common.format_balance(result["result"])
-        results.append(new_entry)
+        try:
+            reply = common.request(common.api_base % int(a.shard), req, session = sessions[int(a.shard)])
+        except requests.exceptions.RequestException as e:
+            print("Error: Request for %s failed: %s" % (a.address, e))
+            reply = None
+        return [(i, new_entry(a, reply))]
+
+    def collect_batch(task):
+        shard = int(task[0][1].shard)
+        req = common.batch_balance_request([a.address for _, a in task])
+        try:
+            replies = common.request_batch(common.api_base % shard, req, session = sessions[shard]) or {}
+        except requests.exceptions.RequestException as e:
+            print("Error: Batch request to shard %d failed: %s" % (shard, e))
+            replies = {}
+        return [(i, new_entry(a, replies.get(r["id"]))) for (i, a), r in zip(task, req)]
+
+    indexed = list(enumerate(address_list))
+    if batch_size > 1:
+        by_shard = {s: [(i, a) for i, a in indexed if int(a.shard) == s] for s in shards}
+        tasks = [by_shard[s][k:k + batch_size] for s in shards for k in range(0, len(by_shard[s]), batch_size)]
+        task = collect_batch
+    else:
+        tasks, task = [[ia] for ia in indexed], collect
+
+    with ThreadPoolExecutor(max_workers = len(shards) * shard_workers) as executor:
+        entries = [e for entries in executor.map(task, tasks) for e in entries]
+    # Results keep the order of the address list
+    balances = [e for _, e in sorted(entries, key = lambda ie: ie[0])]
+    # Balances are exact integer columns, NA if unknown
+    results = pd.DataFrame({"address": [a.address for a in address_list],
+                            "shard": [a.shard for a in address_list],
+                            "index": round,
+                            "one": pd.array([b[0] for b in balances], dtype = 'Int64'),
+                            "atto": pd.array([b[1] for b in balances], dtype = 'Int64')})
 
     if output_dir:
         output_path = os.path.join(output_dir, timestamp.strftime("%b%d%Y_%H%M"))
-        write_output(pd.DataFrame(results), output_path)
+        write_output(results, output_path)
     else:
-        return pd.DataFrame(results)
+        return results
 
 def write_output(collected_data, output_path) -> int:
     v_print("Writing output to %s" % output_path)
@@ -2,15 +2,27 @@
 
 import os
 import json
+import time
+import metrics
 import requests
+import threading
 import decimal as dec
 import datetime as dt
 from collections import namedtuple
 
 # Constants
 encoding = 'utf8'
-atto = 1e18
+# Atto per ONE, balances are kept as exact (whole ONE, atto remainder) integer pairs that fit int64
+atto = 10 ** 18
+# Decimal context wide enough to convert any atto amount to ONE exactly
+exact = dec.Context(prec = 60)
 api_base = 'https://api.s%d.t.hmny.io'
+# Max concurrent requests (and pooled connections) per shard endpoint
+shard_workers = 8
+# Number of addresses per JSON-RPC batch request, 1 to send one request per address
+batch_size = 1
+# Seconds to wait for an RPC reply, so a hung connection can't stall a round
+request_timeout = 30
 
 # Container for Address & Shard
 FoundationalNode = namedtuple('FoundationalNode', ['address', 'shard'])
@@ -22,6 +34,11 @@ def current_balance_request(addr) -> dict:
             "method": "hmy_getBalance",
             "params": [addr, "latest"]}
 
+# Generates a JSON-RPC batch of current balance requests
+# The id of each request is the index of its address in `addrs`
+def batch_balance_request(addrs) -> list:
+    return [dict(current_balance_request(a), id = str(i)) for i, a in enumerate(addrs)]
+
 # Read csv of foundational node addresses & shards generated by collect_addresses.py
 # Give absolute path to the address_file
 def read_addresses(address_file) -> list:
@@ -37,15 +54,40 @@ def read_addresses(address_file) -> list:
         os.exit(-1)
     return address_list
 
+# Pooled HTTP sessions, one per endpoint, reused across rounds
+sessions = {}
+sessions_lock = threading.Lock()
+
+# Get the pooled session of an endpoint
+# The pool blocks when full, bounding the concurrent requests to the endpoint to `workers`
+def endpoint_session(endpoint, workers = shard_workers) -> requests.Session:
+    with sessions_lock:
+        if endpoint not in sessions:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections = 1, pool_maxsize = workers, pool_block = True)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            sessions[endpoint] = session
+        return sessions[endpoint]
+
 # Send RPC request
-# Take API endpoint & request body (as dict)
+# Take API endpoint & request body (as dict), and optionally the session to send it with
 # Returns JSON format reply, None if errors
-def request(endpoint, request, output = False) -> str:
+# Latency & errors are recorded in the RPC metrics of the endpoint
+def request(endpoint, request, output = False, session = None, timeout = request_timeout) -> str:
     # Send request
-    r = requests.get(endpoint, headers = {'Content-Type':'application/json; charset=utf8'}, data = request)
+    start = time.monotonic()
+    try:
+        r = (session or requests).get(endpoint, headers = {'Content-Type':'application/json; charset=utf8'}, data = request, timeout = timeout)
+    except requests.exceptions.RequestException:
+        metrics.rpc_errors.inc(endpoint, 'connection')
+        raise
+    finally:
+        metrics.rpc_latency.observe(time.monotonic() - start, endpoint)
     # Check for invalid status code
     if r.status_code != 200:
         print("Error: Return status code %s" % r.status_code)
+        metrics.rpc_errors.inc(endpoint, 'status')
         return None
 
     # Check for valid JSON format return
@@ -53,15 +95,30 @@ def request(endpoint, request, output = False) -> str:
         r.json()
     except ValueError:
         print("Error: Unable to read JSON reply")
+        metrics.rpc_errors.inc(endpoint, 'json')
         return None
 
     return r.json()
 
-# Format returned balance value
-def format_balance(hex_balance) -> dec.Decimal:
-    dec_balance = int(hex_balance, 16)
+# Send JSON-RPC batch request
+# Take API endpoint & batch body (as list), and optionally the session to send it with
+# Returns the replies by id, None if the whole batch failed
+def request_batch(endpoint, batch, session = None) -> dict:
+    reply = request(endpoint, json.dumps(batch), session = session)
+    if not isinstance(reply, list):
+        print("Error: Invalid batch reply %s" % reply)
+        if reply is not None:
+            metrics.rpc_errors.inc(endpoint, 'batch')
+        return None
+    return {r.get("id"): r for r in reply if isinstance(r, dict)}
+
+# Split returned balance value into (whole ONE, atto remainder)
+def parse_balance(hex_balance) -> tuple:
+    return divmod(int(hex_balance, 16), atto)
 
-    return dec.Decimal(dec_balance) / dec.Decimal(atto)
+# Format an amount of atto as ONE, with `places` decimals
+def format_atto(amount, places = 4) -> str:
+    return f'{exact.scaleb(dec.Decimal(amount), -18):.{places}f}'
 
 # Round time to the nearest 15 minutes
 def round_time(t) -> dt.datetime:
@@ -0,0 +1,91 @@
+#bin/python3
+
+import common
+import threading
+import numpy as np
+from collections import namedtuple
+
+# Exact balance vector: whole ONE & atto remainder (0 <= atto < 10**18) int64 arrays, and a mask of the known balances
+# Unknown balances are 0 in both arrays
+class Balances(namedtuple('Balances', ['one', 'atto', 'valid'])):
+    # Vectorized difference, borrowing a whole ONE where the atto remainder goes negative
+    # Unknown balances are kept at 0, like in the history
+    def __sub__(self, other):
+        valid = self.valid & other.valid
+        one, atto = self.one - other.one, self.atto - other.atto
+        borrow = atto < 0
+        return Balances(np.where(valid, one - borrow, 0), np.where(valid, atto + borrow * common.atto, 0), valid)
+
+    # Indices ordered from the largest balance to the smallest, unknown balances last
+    def order(self):
+        return np.lexsort((-self.atto, -self.one, ~self.valid))
+
+    # Exact amount of atto at `i`, None if unknown
+    def amount(self, i):
+        return int(self.one[i]) * common.atto + int(self.atto[i]) if self.valid[i] else None
+
+    # Display value at `i`, in ONE
+    def format(self, i, places = 4) -> str:
+        return common.format_atto(self.amount(i), places) if self.valid[i] else 'NaN'
+
+    # Approximate values in ONE, NaN if unknown
+    def to_float(self):
+        return np.where(self.valid, self.one + self.atto / common.atto, np.nan)
+
+# Fixed-size ring buffer of balance vectors
+# Row `round % depth` holds the balances of `round`, indexed by address id (position in the address list)
+# Deltas between two rounds are a single vector subtraction, and memory is bounded by `depth`
+class BalanceHistory:
+    def __init__(self, address_list, depth = 10):
+        self.addresses = [a.address for a in address_list]
+        self.shards = [a.shard for a in address_list]
+        self.ids = {address: i for i, address in enumerate(self.addresses)}
+        self.depth = depth
+        self.one = np.zeros((depth, len(self.addresses)), dtype = np.int64)
+        self.atto = np.zeros((depth, len(self.addresses)), dtype = np.int64)
+        self.valid = np.zeros((depth, len(self.addresses)), dtype = bool)
+        # Round held by each row, -1 if empty
+        self.rounds = np.full(depth, -1)
+        self.lock = threading.Lock()
+
+    # Record the balances collected for a round
+    # Take a DataFrame with "address", "one" & "atto" columns, missing addresses & NA balances are unknown
+    def record(self, round, df):
+        row = round % self.depth
+        ids = [self.ids[a] for a in df["address"]]
+        with self.lock:
+            self.one[row, :] = 0
+            self.atto[row, :] = 0
+            self.valid[row, :] = False
+            self.one[row, ids] = df["one"].to_numpy(dtype = np.int64, na_value = 0)
+            self.atto[row, ids] = df["atto"].to_numpy(dtype = np.int64, na_value = 0)
+            self.valid[row, ids] = df["one"].notna().to_numpy()
+            self.rounds[row] = round
+
+    # Returns the balances of a round, None if it is not in the history
+    def get(self, round):
+        row = round % self.depth
+        if round < 0 or self.rounds[row] != round:
+            return None
+        return Balances(self.one[row], self.atto[row], self.valid[row])
+
+    # Returns the balance change of every address from `round - lag` to `round`, None if either is missing
+    def delta(self, round, lag):
+        latest, prev = self.get(round), self.get(round - lag)
+        if latest is None or prev is None:
+            return None
+        return latest - prev
+
+    # Latest recorded round, -1 if the history is empty
+    def latest(self) -> int:
+        return int(self.rounds.max())
+
+    # Returns the [(round, atto)] of an address held in the history, oldest first, None for unknown addresses
+    # Balances that failed to be collected are None
+    def of(self, address):
+        if address not in self.ids:
+            return None
+        i = self.ids[address]
+        with self.lock:
+            return sorted((int(r), Balances(self.one[row], self.atto[row], self.valid[row]).amount(i))
+                          for row, r in enumerate(self.rounds) if r >= 0)
@@ -0,0 +1,101 @@
+#bin/python3
+
+import math
+import bisect
+import threading
+
+# Minimal Prometheus instruments, rendered in the text exposition format by `expose()`
+# Every metric has a fixed list of label names, and values are kept per tuple of label values
+
+registry = []
+
+def format_value(v) -> str:
+    if math.isnan(v):
+        return 'NaN'
+    if math.isinf(v):
+        return '+Inf' if v > 0 else '-Inf'
+    return repr(float(v))
+
+def format_labels(names, values) -> str:
+    if not names:
+        return ''
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{%s}' % ','.join('%s="%s"' % (n, escape(v)) for n, v in zip(names, values))
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labels = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def expose(self) -> list:
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s %s" % (self.name, self.type)]
+        with self.lock:
+            for key, value in self.values.items():
+                lines.append("%s%s %s" % (self.name, format_labels(self.labels, key), format_value(value)))
+        return lines
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    # Replace every series of the gauge, so label sets that disappear stop being exposed
+    # Take {label values tuple: value}
+    def replace(self, values):
+        with self.lock:
+            self.values = dict(values)
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels = (), buckets = (.05, .1, .25, .5, 1, 2.5, 5, 10)):
+        super().__init__(name, help, labels)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value, *labels):
+        with self.lock:
+            # [count per bucket, +Inf included], sum
+            counts, total = self.values.get(labels, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[labels] = (counts, total + value)
+
+    def expose(self) -> list:
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s %s" % (self.name, self.type)]
+        with self.lock:
+            for key, (counts, total) in self.values.items():
+                cumulative = 0
+                for le, count in zip(self.buckets + [math.inf], counts):
+                    cumulative += count
+                    lines.append("%s_bucket%s %d" % (self.name, format_labels(self.labels + ('le',), key + (format_value(le),)), cumulative))
+                lines.append("%s_sum%s %s" % (self.name, format_labels(self.labels, key), format_value(total)))
+                lines.append("%s_count%s %d" % (self.name, format_labels(self.labels, key), cumulative))
+        return lines
+
+# All registered metrics in the Prometheus text format
+def expose() -> str:
+    return '\n'.join(line for metric in registry for line in metric.expose()) + '\n'
+
+# Balance monitor metrics
+balance = Gauge('balance_monitor_balance_one', "Balance of a tracked address, in ONE", ('address', 'shard'))
+shard_balance = Gauge('balance_monitor_shard_balance_one', "Total balance of the tracked addresses of a shard, in ONE", ('shard',))
+round_delta = Gauge('balance_monitor_round_delta_one', "Balance change of a tracked address since the previous round, in ONE", ('address', 'shard'))
+last_round = Gauge('balance_monitor_round', "Last collected round")
+collection_seconds = Gauge('balance_monitor_collection_seconds', "Collection time of the last collected round")
+skipped_rounds = Counter('balance_monitor_skipped_rounds_total', "Rounds skipped because the previous collection was still running")
+rpc_latency = Histogram('balance_monitor_rpc_duration_seconds', "RPC request latency", ('endpoint',))
+rpc_errors = Counter('balance_monitor_rpc_errors_total', "Failed RPC requests", ('endpoint', 'reason'))
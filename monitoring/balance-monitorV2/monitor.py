@@ -2,62 +2,99 @@
 
 import argparse
 import common
-import threading
-import http.server
-import socketserver
 import os, sys
-import time
-import queue
+import json
+import hashlib
+import metrics
+import numpy as np
 from collect_data import collect_data
+from history import BalanceHistory
+from store import BalanceStore, round_of
+from scheduler import RoundScheduler
+from server import MonitorServer
 from datetime import datetime
-from jinja2 import Environment, FileSystemLoader
-import pandas as pd
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
 
-data = pd.DataFrame()
+# Rounds are 15 minutes, deltas are over an hour
+delta_rounds = 4
+history_rounds = 10
 
-def monitor(address_list, round, data, out):
+# Collect a round and record it, returns the balance deltas over `delta_rounds` (None if unknown)
+def collect(address_list, round, history, store, batch_size = common.batch_size):
     print("Starting monitor")
-    df = collect_data(address_list, round)
+    df = collect_data(address_list, round, batch_size = batch_size)
+    store.append(round, df)
+    history.record(round, df)
+    export(history, round)
+    return history.delta(round, delta_rounds)
 
-    if data.empty:
-        data = df
-    else:
-        data = data.append(df)
+# Export the balances of a round to the Prometheus metrics
+def export(history, round):
+    balances = history.get(round)
+    delta = history.delta(round, 1)
+    keys = list(zip(history.addresses, history.shards))
+    metrics.balance.replace(zip(keys, balances.to_float()))
+    metrics.round_delta.replace({} if delta is None else zip(keys, delta.to_float()))
+    shards = np.array(history.shards)
+    totals = {}
+    for shard in dict.fromkeys(history.shards):
+        known = (shards == shard) & balances.valid
+        totals[(shard,)] = balances.one[known].sum() + balances.atto[known].sum(dtype = float) / common.atto
+    metrics.shard_balance.replace(totals)
+    metrics.last_round.set(round)
 
-    latest_data = data.loc[data["index"] == round]
-    prev_data = data.loc[data["index"] == (round - 4)]
+# Renders the shard/delta table to `output`
+# The template is compiled once, with its bytecode cached across restarts, and the page is replaced atomically
+# The latest page & table are also kept in memory, as (body, ETag) for the HTTP server
+class PageRenderer:
+    def __init__(self, template_dir = 'templates/', output = 'index.html'):
+        env = Environment(loader = FileSystemLoader(template_dir), auto_reload = False, bytecode_cache = FileSystemBytecodeCache())
+        self.template = env.get_template('base.html.j2')
+        self.output = output
+        self.digest = None
+        self.page = None
+        self.table = None
 
-    calculated = {}
-    if not prev_data.empty:
-        for index, value in latest_data.iterrows():
-            shard, address = value["shard"], value["address"]
-            if shard not in list(calculated.keys()):
-                calculated[shard] = {}
-            address = value["address"]
-            past_value = prev_data.loc[prev_data["address"] == address].iloc[0]
-            calculated[shard][address] = f'{value["balance"] - past_value["balance"]:.4f}'
+    # Returns False without rendering if the table is unchanged since the last render
+    def render(self, shards) -> bool:
+        table = json.dumps(shards).encode()
+        digest = hashlib.sha256(table).hexdigest()
+        if digest == self.digest:
+            return False
+        page = self.template.render(shards = shards, time = datetime.now()).encode()
+        tmp = self.output + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(page)
+        os.replace(tmp, self.output)
+        self.digest = digest
+        self.page = (page, '"p-%s"' % digest)
+        self.table = (table, '"s-%s"' % digest)
+        return True
 
-        for k in calculated.keys():
-            calculated[k] = {key: value for key, value in sorted(calculated[k].items(), key = lambda item: item[1], reverse = True)}
+# Render the deltas of a round
+def render(history, renderer, round, delta):
+    calculated = {}
+    if delta is not None:
+        # Shards in address list order, largest earnings first, unknown (NaN) last
+        calculated = {shard: {} for shard in history.shards}
+        for i in delta.order():
+            calculated[history.shards[i]][history.addresses[i]] = delta.format(i)
     else:
-        for index, value in latest_data.iterrows():
-            shard, address = value["shard"], value["address"]
-            if shard not in list(calculated.keys()):
-                calculated[shard] = {}
-            calculated[shard][address] = "NA"
+        for shard, address in zip(history.shards, history.addresses):
+            calculated.setdefault(shard, {})[address] = "NA"
 
-    env = Environment(loader = FileSystemLoader('templates/'), auto_reload = False)
-    template = env.get_template('base.html.j2')
-    with open('index.html', 'w') as f:
-        f.write(template.render(shards = calculated, time = datetime.now))
-
-    print("Outputted template")
-    data = data.loc[data["index"] > round - 10]
-    out.put(data)
+    if renderer.render(calculated):
+        print("Outputted template")
+    else:
+        print("Deltas unchanged, skipped template")
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--address-list', dest = 'address_list', required = True, help = "List of ONE addresses to track")
+    parser.add_argument('--db', dest = 'db', default = 'balances.db', help = "Balance store, kept across restarts")
+    parser.add_argument('--batch-size', dest = 'batch_size', type = int, default = common.batch_size, help = "Addresses per JSON-RPC batch request")
+    parser.add_argument('--host', dest = 'host', default = '127.0.0.1', help = "Interface to serve the page & JSON API on, 0.0.0.0 for all interfaces")
+    parser.add_argument('--port', dest = 'port', type = int, default = 8080, help = "Port to serve the page & JSON API on, 0 to disable")
     parser.add_argument('--verbose', action = 'store_true', help = "Verbose for debug")
 
     args = parser.parse_args()
@@ -78,17 +115,18 @@ if __name__ == '__main__':
         print("Error: Address list is empty")
         sys.exit(-1)
 
-    round = 0
-    q = queue.Queue()
+    history = BalanceHistory(addr, history_rounds)
+    store = BalanceStore(args.db)
+    # Warm start the history from the stored rounds
+    for r, df in store.last_rounds(round_of(datetime.now()), history_rounds).items():
+        history.record(r, df[df["address"].isin(history.ids)])
+
+    renderer = PageRenderer()
+    if args.port:
+        MonitorServer(renderer, history, host = args.host, port = args.port).start()
+    scheduler = RoundScheduler(lambda round: collect(addr, round, history, store, args.batch_size),
+                               lambda round, delta: render(history, renderer, round, delta))
     try:
-        while True:
-            v_print(datetime.now())
-            thread = threading.Thread(target = monitor, args = (addr, round, data, q))
-            thread.start()
-            round += 1
-            time.sleep(900)
-            thread.join()
-            data = q.get()
-            print(data)
+        scheduler.run()
     except KeyboardInterrupt:
-        pass
+        scheduler.stop()
@@ -0,0 +1,74 @@
+#bin/python3
+
+import time
+import queue
+import threading
+import metrics
+from store import round_seconds
+
+# Runs `collect(round)` at every wall-clock round boundary and `render(round, result)` on its own thread
+# Rounds are scheduled against the clock instead of fixed sleeps, so collection time doesn't accumulate as drift,
+# and rendering a round overlaps with collecting the next one
+# A boundary reached while the previous collection is still running is skipped and flagged rather than queued
+class RoundScheduler:
+    def __init__(self, collect, render, interval = round_seconds, warn_ratio = 0.8):
+        self.collect = collect
+        self.render = render
+        self.interval = interval
+        self.warn_ratio = warn_ratio
+        self.skipped = 0
+        self.collecting = None
+        self.rendering = queue.Queue()
+        self.stopped = threading.Event()
+
+    def run(self):
+        threading.Thread(target = self._render_loop, daemon = True).start()
+        # The first round starts right away, in the slot it was started in
+        round = int(time.time() // self.interval)
+        while not self.stopped.is_set():
+            if self.collecting is not None:
+                self.skipped += 1
+                metrics.skipped_rounds.inc()
+                print("Warning: skipping round %d, round %d is still collecting" % (round, self.collecting))
+            else:
+                self.collecting = round
+                threading.Thread(target = self._collect, args = (round,), daemon = True).start()
+
+            next_round = max(round + 1, int(time.time() // self.interval))
+            if next_round > round + 1:
+                print("Warning: missed rounds %d to %d" % (round + 1, next_round - 1))
+                self.skipped += next_round - round - 1
+                metrics.skipped_rounds.inc(amount = next_round - round - 1)
+            round = next_round
+            self.stopped.wait(max(0, round * self.interval - time.time()))
+
+    def stop(self):
+        self.stopped.set()
+        self.rendering.put(None)
+
+    def _collect(self, round):
+        start = time.monotonic()
+        failed = False
+        try:
+            result = self.collect(round)
+        except Exception as e:
+            print("Error: round %d collection failed: %s" % (round, e))
+            failed = True
+        latency = time.monotonic() - start
+        metrics.collection_seconds.set(latency)
+        print("Round %d collected in %.2fs" % (round, latency))
+        if latency > self.warn_ratio * self.interval:
+            print("Warning: round %d collection took %d%% of the round interval" % (round, 100 * latency / self.interval))
+        self.collecting = None
+        if not failed:
+            self.rendering.put((round, result))
+
+    def _render_loop(self):
+        while True:
+            item = self.rendering.get()
+            if item is None:
+                return
+            try:
+                self.render(*item)
+            except Exception as e:
+                print("Error: round %d render failed: %s" % (item[0], e))
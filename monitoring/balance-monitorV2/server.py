@@ -0,0 +1,118 @@
+#bin/python3
+
+import os
+import json
+import asyncio
+import threading
+import common
+import metrics
+import mimetypes
+from urllib.parse import urlsplit, unquote
+
+# Minimal HTTP/1.1 server on asyncio, serving the monitor's results from memory:
+#   /                          latest rendered page
+#   /shards                    latest shard/delta table
+#   /address/<addr>/history    balances of an address held in the history
+#   /metrics                   Prometheus metrics
+# Responses carry an ETag, so clients polling with If-None-Match get an empty 304 until the next round
+class MonitorServer:
+    def __init__(self, renderer, history, host = '127.0.0.1', port = 8080, static_dir = 'templates/'):
+        self.renderer = renderer
+        self.history = history
+        self.host = host
+        self.port = port
+        self.static_dir = os.path.abspath(static_dir)
+
+    # Serve on a background thread with its own event loop
+    def start(self):
+        threading.Thread(target = asyncio.run, args = (self.serve(),), daemon = True).start()
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        print("Serving on %s:%d" % (self.host, self.port))
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, target, version = line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                if method not in ('GET', 'HEAD'):
+                    status, content_type, etag, body = 405, 'text/plain', None, lambda: b'Method Not Allowed'
+                else:
+                    status, content_type, etag, body = self.route(unquote(urlsplit(target).path))
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+                if etag is not None and etag in [t.strip() for t in headers.get('if-none-match', '').split(',')]:
+                    status, content = 304, b''
+                else:
+                    content = body()
+                head = ["HTTP/1.1 %d %s" % (status, responses.get(status, '')),
+                        "Content-Length: %d" % len(content),
+                        "Connection: %s" % ('keep-alive' if keep_alive else 'close')]
+                if status != 304:
+                    head.append("Content-Type: %s" % content_type)
+                if etag is not None:
+                    head.append("ETag: %s" % etag)
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+                if method != 'HEAD':
+                    writer.write(content)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ValueError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    # Returns (status, content type, ETag, body), the body is only built if the ETag doesn't match
+    def route(self, path):
+        parts = [p for p in path.split('/') if p]
+        if parts in ([], ['index.html']):
+            return self.cached(self.renderer.page, 'text/html; charset=utf-8')
+        if parts == ['shards']:
+            return self.cached(self.renderer.table, 'application/json')
+        if parts == ['metrics']:
+            return 200, 'text/plain; version=0.0.4', None, lambda: metrics.expose().encode()
+        if len(parts) == 3 and parts[0] == 'address' and parts[2] == 'history':
+            return self.address_history(parts[1])
+        return self.static(parts)
+
+    def cached(self, entry, content_type):
+        if entry is None:
+            return 503, 'text/plain', None, lambda: b'No round rendered yet'
+        body, etag = entry
+        return 200, content_type, etag, lambda: body
+
+    def address_history(self, address):
+        if address not in self.history.ids:
+            return 404, 'text/plain', None, lambda: b'Unknown address'
+        def body():
+            balances = [{"round": r, "balance": None if b is None else common.format_atto(b, 18)} for r, b in self.history.of(address)]
+            return json.dumps({"address": address, "history": balances}).encode()
+        # An address' history only changes when a new round is recorded
+        return 200, 'application/json', '"h-%d"' % self.history.latest(), body
+
+    # Stylesheet & images referenced by the page
+    def static(self, parts):
+        path = os.path.abspath(os.path.join(self.static_dir, *parts))
+        if not path.startswith(self.static_dir + os.sep) or not os.path.isfile(path) or path.endswith('.j2'):
+            return 404, 'text/plain', None, lambda: b'Not Found'
+        etag = '"f-%x-%x"' % (os.stat(path).st_mtime_ns, os.stat(path).st_size)
+        def body():
+            with open(path, 'rb') as f:
+                return f.read()
+        return 200, mimetypes.guess_type(path)[0] or 'application/octet-stream', etag, body
+
+responses = {200: 'OK', 304: 'Not Modified', 404: 'Not Found', 405: 'Method Not Allowed', 503: 'Service Unavailable'}
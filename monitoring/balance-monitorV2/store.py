@@ -0,0 +1,75 @@
+#bin/python3
+
+import argparse
+import sqlite3
+import threading
+import common
+import pandas as pd
+import datetime as dt
+
+# Rounds are 15 minute wall-clock slots numbered from the Unix epoch, so they survive restarts
+round_seconds = 900
+
+# Round number of a datetime
+def round_of(t) -> int:
+    return int(t.timestamp() // round_seconds)
+
+# Append-only SQLite store of the balances collected each round
+# Balances are stored as exact (whole ONE, atto remainder) integers, indexed by (address, round) for range queries
+class BalanceStore:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread = False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS balances (
+                address TEXT NOT NULL,
+                round INTEGER NOT NULL,
+                shard INTEGER NOT NULL,
+                one INTEGER NOT NULL,
+                atto INTEGER NOT NULL,
+                PRIMARY KEY (address, round)
+            );
+            CREATE INDEX IF NOT EXISTS balances_round_idx ON balances (round);
+        """)
+
+    # Append the balances collected for a round (DataFrame with address, shard, one & atto columns)
+    def append(self, round, df):
+        # Failed requests (NA) are not stored
+        known = df[df["one"].notna()]
+        rows = [(a, round, int(s), int(o), int(x)) for a, s, o, x in zip(known["address"], known["shard"], known["one"], known["atto"])]
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO balances VALUES (?, ?, ?, ?, ?)", rows)
+
+    # Returns the rounds stored in (`round - count`, `round`], as {round: DataFrame} in the collect_data format
+    def last_rounds(self, round, count) -> dict:
+        with self.lock:
+            rows = self.db.execute("SELECT address, shard, round, one, atto FROM balances WHERE round > ? AND round <= ? ORDER BY round",
+                                   (round - count, round)).fetchall()
+        df = pd.DataFrame(rows, columns = ["address", "shard", "index", "one", "atto"])
+        df["shard"] = df["shard"].astype(str)
+        df = df.astype({"one": 'Int64', "atto": 'Int64'})
+        return {r: group for r, group in df.groupby("index")}
+
+    # Returns the balance change in atto of an address from its first round since `since_round` to its latest, None if unknown
+    def delta(self, address, since_round) -> int:
+        with self.lock:
+            first = self.db.execute("SELECT one, atto FROM balances WHERE address = ? AND round >= ? ORDER BY round LIMIT 1",
+                                    (address, since_round)).fetchone()
+            last = self.db.execute("SELECT one, atto FROM balances WHERE address = ? AND round >= ? ORDER BY round DESC LIMIT 1",
+                                   (address, since_round)).fetchone()
+        if first is None:
+            return None
+        return (last[0] - first[0]) * common.atto + last[1] - first[1]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', dest = 'db', required = True, help = "Balance store to query")
+    parser.add_argument('--address', dest = 'address', required = True, help = "ONE address to query")
+    parser.add_argument('--hours', dest = 'hours', type = float, default = 24, help = "Period to compute the balance delta over")
+
+    args = parser.parse_args()
+
+    store = BalanceStore(args.db)
+    since = round_of(dt.datetime.now() - dt.timedelta(hours = args.hours))
+    delta = store.delta(args.address, since)
+    print("Balance delta of %s over the last %sh: %s" % (args.address, args.hours, None if delta is None else common.format_atto(delta, 18)))